@@ -1,75 +1,1036 @@
-import requests
 import time
-import spacy
+import_started = time.perf_counter()
+
+import requests
+import sys
+import argparse
 import json
 import re
+import os
+import atexit
+import sqlite3
+import threading
+import multiprocessing
+import random
 import langcodes
+from email.utils import parsedate_to_datetime
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
 
-nlp = spacy.load('nl_core_news_lg')
+# Pipeline components that find_QP does not use, these are not loaded
+UNUSED_PIPES = ['ner']
+NLP_BATCH_SIZE = 64
+NLP_PROCESSES = 1 # processes used by parseQuestions, -1 uses all cores
 
-'''Function to find answers to a given query'''
-def getAnswer(query): 
+# The spaCy model is loaded on first use (see getNLP). Choose it with the
+# VASYSTEEM_MODEL environment variable: 'lg', 'md', 'sm' or a full model name.
+MODEL_SIZES = {
+    'lg': 'nl_core_news_lg',
+    'md': 'nl_core_news_md',
+    'sm': 'nl_core_news_sm'
+}
+SPACY_MODEL = os.environ.get('VASYSTEEM_MODEL', 'lg')
+SPACY_MODEL = MODEL_SIZES.get(SPACY_MODEL, SPACY_MODEL)
+
+nlp = None
+nlp_lock = threading.Lock()
+startup_times = {}
+
+'''Returns the spaCy model, loading it on first use'''
+def getNLP():
+    global nlp
+    if nlp is None:
+        with nlp_lock:
+            if nlp is None:
+                started = time.perf_counter()
+                import spacy
+                model = spacy.load(SPACY_MODEL, exclude=UNUSED_PIPES)
+                startup_times['model_load'] = time.perf_counter() - started
+                nlp = model
+    return nlp
+
+'''Loads the model and builds the property vectors, when that was not done yet'''
+def loadModels():
+    getNLP()
+    if SEMANTIC_MATCHING and property_vectors is None:
+        started = time.perf_counter()
+        getPropertyVectors()
+        startup_times['property_vectors'] = time.perf_counter() - started
+
+'''Loads the model and builds the property vectors ahead of time, e.g. before forking
+worker processes, so the first questions do not spend their time budget on them'''
+def warmup():
+    loadModels()
+    return startupReport()
+
+'''Returns a process pool whose workers share the loaded model. The model is loaded
+before forking, so the workers get it copy-on-write instead of loading it themselves.
+Used by runEvaluation with --fork-workers.'''
+def workerPool(processes):
+    warmup()
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'),
+                               initializer=forkedWorker)
+
+'''Runs in every worker of workerPool, right after the fork. The SQLite and HTTP
+connections, threads and locks of the parent must not be used in a child, so these
+are made anew; the model and the cached entries are kept.'''
+def forkedWorker():
+    global nlp_lock, session, query_pool, hedge_pool, trace_file_lock, host_limiters_lock
+    global sparql_cache, local_store, local_store_lock, property_vectors_lock, question_type_lock
+    nlp_lock = threading.Lock()
+    trace_file_lock = threading.Lock()
+    host_limiters_lock = threading.Lock()
+    local_store_lock = threading.Lock()
+    property_vectors_lock = threading.Lock()
+    question_type_lock = threading.Lock()
+    for shared in [search_cache, answer_cache, batch_results, animal_memo, pipeline_stats]:
+        shared.lock = threading.Lock()
+    host_limiters.clear()
+    session = newSession()
+    query_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    hedge_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    sparql_cache = SparqlCache(SPARQL_CACHE_FILE, SPARQL_CACHE_SIZE, SPARQL_CACHE_TTL, SPARQL_CACHE_READ_ONLY)
+    # The store is opened again on first use
+    local_store = None
+
+'''Returns how long importing the module and loading the model took (in seconds)'''
+def startupReport():
+    report = {
+        'model': SPACY_MODEL,
+        'model_loaded': nlp is not None,
+        'import': startup_times.get('import'),
+        'model_load': startup_times.get('model_load'),
+        'property_vectors': startup_times.get('property_vectors')
+    }
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        report['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+    return report
+
+# Settings for the HTTP connections to Wikidata
+MAX_CONCURRENCY_PER_HOST = {
+    'query.wikidata.org': 5,
+    'www.wikidata.org': 10
+}
+DEFAULT_CONCURRENCY = 4 # for hosts not in MAX_CONCURRENCY_PER_HOST
+REQUESTS_PER_SECOND = {
+    'query.wikidata.org': 5.0,
+    'www.wikidata.org': 20.0
+}
+DEFAULT_REQUESTS_PER_SECOND = 5.0
+REQUEST_TIMEOUT = 60 # seconds
+# Seconds before a slow request to a host is sent a second time, hosts that are not listed
+# are never hedged. Not query.wikidata.org: a slow query is slow every time, a copy only doubles the load.
+HEDGE_AFTER = {
+    'www.wikidata.org': 5.0
+}
+MAX_RETRIES = 5 # per request
+RETRY_BUDGET = 10 # retries a host may have outstanding, refilled by successful requests
+RETRY_REFILL = 0.2 # retries earned per successful request
+BACKOFF_BASE = 1.0 # seconds
+BACKOFF_MAX = 60.0 # seconds
+RETRY_STATUS = [429, 500, 502, 503, 504]
+MAX_WORKERS = 16 # threads used to run lookups and queries concurrently
+
+# 'single' answers a question with one VALUES query, 'pairs' with one query per ID combination
+QUERY_PLAN = 'single'
+
+# 'wikidata' uses the live endpoints, 'local' the offline store built by knowledge_store.py
+BACKEND = os.environ.get('VASYSTEEM_BACKEND', 'wikidata')
+LOCAL_STORE_FILE = 'animals.sqlite'
+
+# 'wikidata' links entities with wbsearchentities, 'local' with the alias index built by alias_index.py
+ENTITY_LINKER = os.environ.get('VASYSTEEM_LINKER', 'wikidata')
+ALIAS_INDEX_FILE = 'aliases.idx'
+
+# Property labels are looked up in this index (built by property_index.py) when it exists
+PROPERTY_INDEX_FILE = 'properties.idx'
+
+# Semantic matching of question words to property labels (needs numpy)
+SEMANTIC_MATCHING = numpy is not None
+SEMANTIC_TOP_K = 3
+SEMANTIC_CUTOFF = 0.6 # minimal cosine similarity
+PROPERTY_VECTORS_FILE = 'property_vectors.npz'
+CONTENT_POS = ['NOUN', 'VERB', 'ADJ', 'ADV']
+
+'''Returns a session with a keep-alive connection pool'''
+def newSession():
+    new_session = requests.Session()
+    new_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+    return new_session
+
+# One keep-alive connection pool, shared by all requests
+session = newSession()
+query_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+hedge_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+# Early exit for the 'pairs' plan: queries run EARLY_EXIT_WAVE at a time and stop at
+# the first acceptable answer. MAX_COMBINATIONS caps the (QID, PID) combinations tried, in
+# both plans (the 'single' plan then only asks for the first ones in its query).
+EARLY_EXIT_WAVE = MAX_CONCURRENCY_PER_HOST['query.wikidata.org']
+MAX_COMBINATIONS = None
+RANK_BY_CONFIDENCE = False # True tries candidates with both animal signals first (can change answers)
+
+# Time budget of one question (seconds, None for no limit), and the share of each stage
+QUESTION_BUDGET = 60.0
+STAGE_BUDGETS = {
+    'parse': 0.05,
+    'search': 0.3,
+    'animal': 0.25,
+    'values': 0.4
+}
+
+# Instrumentation: every question gets a Trace (time per stage, HTTP requests, errors),
+# which is added to the aggregate histograms of pipeline_stats (see metricsReport)
+TRACE_FILE = None # JSONL file that gets the trace of every question, None to write none
+HISTOGRAM_BOUNDS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0] # seconds
+RECENT_ERRORS = 20 # errors kept with their message
+
+'''Counts of values (latencies in seconds) per bucket of HISTOGRAM_BOUNDS'''
+class Histogram:
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        n = 0
+        while n < len(self.bounds) and value > self.bounds[n]:
+            n += 1
+        self.buckets[n] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def toDict(self):
+        buckets = {}
+        for bound, count in zip(self.bounds, self.buckets):
+            buckets['<=' + str(bound)] = count
+        buckets['>' + str(self.bounds[-1])] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': buckets
+        }
+
+'''What happened while answering one question'''
+class Trace:
+    def __init__(self, question):
+        self.question = question
+        self.question_type = None
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stages = {}
+        self.requests = {}
+        self.bytes = 0
+        self.throttled = 0
+        self.retries = 0
+        self.errors = []
+        self.reason = None
+        self.deadline = None # set by answerQuestionDetailed, used by request()
+        self.lock = threading.Lock()
+
+    def addStage(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def addRequest(self, host, size, status):
+        with self.lock:
+            self.requests[host] = self.requests.get(host, 0) + 1
+            self.bytes += size
+            if status == 429:
+                self.throttled += 1
+
+    def addRetry(self):
+        with self.lock:
+            self.retries += 1
+
+    def addError(self, where, error):
+        with self.lock:
+            self.errors.append({'stage': where, 'type': type(error).__name__, 'message': str(error)})
+
+    def finish(self, reason):
+        self.reason = reason
+        self.seconds = time.perf_counter() - self.started
+
+    def toDict(self):
+        with self.lock:
+            return {
+                'question': self.question,
+                'question_type': self.question_type,
+                'reason': self.reason,
+                'seconds': self.seconds,
+                'stages': dict(self.stages),
+                'requests': dict(self.requests),
+                'bytes': self.bytes,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'errors': list(self.errors)
+            }
+
+'''Aggregate statistics of all questions and requests since the start'''
+class PipelineStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.questions = {}
+        self.hosts = {}
+        self.errors = {}
+        self.recent_errors = deque(maxlen=RECENT_ERRORS)
+
+    def addStage(self, name, seconds):
+        with self.lock:
+            self.stages.setdefault(name, Histogram()).add(seconds)
+
+    def host(self, host):
+        return self.hosts.setdefault(host, {'requests': 0, 'bytes': 0, 'throttled': 0, 'retries': 0, 'failures': 0})
+
+    def addRequest(self, host, size, status):
+        with self.lock:
+            counts = self.host(host)
+            counts['requests'] += 1
+            counts['bytes'] += size
+            if status == 429:
+                counts['throttled'] += 1
+
+    def addRetry(self, host):
+        with self.lock:
+            self.host(host)['retries'] += 1
+
+    def addFailure(self, host):
+        with self.lock:
+            self.host(host)['failures'] += 1
+
+    def addError(self, where, error, question=None):
+        key = where + ': ' + type(error).__name__
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+            self.recent_errors.append({'stage': where, 'type': type(error).__name__,
+                                       'message': str(error), 'question': question})
+
+    def addQuestion(self, trace):
+        with self.lock:
+            for name, seconds in trace.stages.items():
+                self.stages.setdefault(name, Histogram()).add(seconds)
+            kind = self.questions.setdefault(trace.question_type or 'unknown',
+                                             {'latency': Histogram(), 'requests': Histogram([0, 1, 2, 5, 10, 20, 50]), 'reasons': {}})
+            kind['latency'].add(trace.seconds)
+            kind['requests'].add(sum(trace.requests.values()))
+            reason = trace.reason.split(':')[0]
+            kind['reasons'][reason] = kind['reasons'].get(reason, 0) + 1
+
+    def report(self):
+        with self.lock:
+            return {
+                'stages': {name: histogram.toDict() for name, histogram in self.stages.items()},
+                'question_types': {name: {'latency': kind['latency'].toDict(),
+                                          'requests': kind['requests'].toDict(),
+                                          'reasons': dict(kind['reasons'])}
+                                   for name, kind in self.questions.items()},
+                'hosts': {host: dict(counts) for host, counts in self.hosts.items()},
+                'errors': dict(self.errors),
+                'recent_errors': list(self.recent_errors)
+            }
+
+pipeline_stats = PipelineStats()
+trace_file_lock = threading.Lock()
+
+# The trace of the question the current thread works on
+current_trace = threading.local()
+
+'''Returns the trace of the current thread, or None'''
+def activeTrace():
+    return getattr(current_trace, 'trace', None)
+
+'''Returns the function, made to run with the trace of the calling thread. Used for the
+functions that are given to query_pool, so their requests count for the question.'''
+def traced(function):
+    trace = activeTrace()
+    if trace is None:
+        return function
+    def run(*args, **kwargs):
+        previous = activeTrace()
+        current_trace.trace = trace
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current_trace.trace = previous
+    return run
+
+'''Times a stage of the current question (or only the aggregate when there is none)'''
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace = activeTrace()
+        if trace is not None:
+            trace.addStage(name, seconds)
+        else:
+            pipeline_stats.addStage(name, seconds)
+
+'''Records an error that is handled (the question goes on, or is answered with null)'''
+def recordError(where, error):
+    trace = activeTrace()
+    if trace is not None:
+        trace.addError(where, error)
+    pipeline_stats.addError(where, error, trace.question if trace is not None else None)
+
+'''Adds a finished trace to the aggregate statistics and to TRACE_FILE'''
+def recordTrace(trace):
+    pipeline_stats.addQuestion(trace)
+    if TRACE_FILE is not None:
+        line = json.dumps(trace.toDict(), ensure_ascii=False)
+        with trace_file_lock:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+'''Raised when a request to Wikidata fails, also after retrying'''
+class WikidataError(Exception):
+    pass
+
+'''Token bucket that limits the number of requests per second'''
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    # Takes a token only when one is available now
+    def tryAcquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    # No requests are let through until the pause is over (used for Retry-After)
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+'''Limits the requests to one host: the number running at the same time, which is
+halved when the host throttles us and grows back by one per limit successes,
+the rate (token bucket) and the number of retries (retry budget)'''
+class HostLimiter:
+    def __init__(self, limit, rate):
+        self.max_limit = limit
+        self.limit = limit
+        self.active = 0
+        self.successes = 0
+        self.retry_tokens = RETRY_BUDGET
+        self.bucket = TokenBucket(rate)
+        self.condition = threading.Condition()
+
+    def enter(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    # Takes a slot only when one is free now
+    def tryEnter(self):
+        with self.condition:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.leave()
+
+    def succeeded(self):
+        with self.condition:
+            self.retry_tokens = min(RETRY_BUDGET, self.retry_tokens + RETRY_REFILL)
+            if self.limit < self.max_limit:
+                self.successes += 1
+                if self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+                    self.condition.notify()
+
+    def throttled(self):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+
+    # Returns False when the retry budget is used up
+    def spendRetry(self):
+        with self.condition:
+            if self.retry_tokens < 1:
+                return False
+            self.retry_tokens -= 1
+            return True
+
+host_limiters = {}
+host_limiters_lock = threading.Lock()
+
+'''Returns the limiter of a host, creating it on first use'''
+def hostLimiter(host):
+    with host_limiters_lock:
+        if host not in host_limiters:
+            host_limiters[host] = HostLimiter(MAX_CONCURRENCY_PER_HOST.get(host, DEFAULT_CONCURRENCY),
+                                              REQUESTS_PER_SECOND.get(host, DEFAULT_REQUESTS_PER_SECOND))
+        return host_limiters[host]
+
+'''Returns the number of seconds given by a Retry-After header, or None'''
+def retryAfter(response):
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Retry-After can also be a date
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+'''Returns the wait before a retry: exponential backoff with full jitter'''
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+'''GET request through the shared session, the caller holds a slot of the limiter for
+it, which is given back when the response is in'''
+def limitedGet(limiter, url, params, timeout):
+    try:
+        return session.get(url, params=params, timeout=timeout)
+    finally:
+        limiter.leave()
+
+'''GET request through the shared session, in a slot of the limiter the caller took.
+When the host is in HEDGE_AFTER and the request has not answered in that time, a copy
+is sent, but only when a token and a slot are free right away. The first good response
+is used; a throttled or failed one only when no other copy is still running.'''
+def hedgedGet(url, params, limiter, timeout=REQUEST_TIMEOUT):
+    hedge_after = HEDGE_AFTER.get(urlparse(url).netloc)
+    if hedge_after is None:
+        return limitedGet(limiter, url, params, timeout)
+    futures = [hedge_pool.submit(limitedGet, limiter, url, params, timeout)]
+    done, pending = wait(futures, timeout=hedge_after)
+    if not done and limiter.tryEnter():
+        if limiter.bucket.tryAcquire():
+            futures.append(hedge_pool.submit(limitedGet, limiter, url, params, timeout))
+        else:
+            limiter.leave()
+    response = None
+    error = None
+    while futures:
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            futures.remove(future)
+            try:
+                result = future.result()
+            except requests.exceptions.RequestException as e:
+                error = e
+                continue
+            if result.status_code == 200:
+                return result
+            response = result
+    if response is not None:
+        return response
+    raise error
+
+'''GET request to Wikidata through the shared session, returns the decoded JSON.
+Keeps to the rate and concurrency limits of the host, honours Retry-After and
+retries failed requests with backoff, as long as the retry budget allows. No
+attempt is made or waited for after the deadline (by default the one of the
+question the thread works on), DeadlineExceeded is raised instead.'''
+def request(url, params, deadline=None):
+    host = urlparse(url).netloc
+    limiter = hostLimiter(host)
+    trace = activeTrace()
+    if deadline is None and trace is not None:
+        deadline = trace.deadline
+    attempt = 0
+    while True:
+        timeout = REQUEST_TIMEOUT
+        if deadline is not None and deadline.left() is not None:
+            if deadline.left() <= 0:
+                raise DeadlineExceeded('request')
+            timeout = min(timeout, deadline.left())
+        limiter.bucket.acquire()
+        limiter.enter()
+        try:
+            response = hedgedGet(url, params, limiter, timeout)
+        except requests.exceptions.RequestException as e:
+            response = None
+            problem = type(e).__name__
+            pipeline_stats.addFailure(host)
+        if response is not None:
+            pipeline_stats.addRequest(host, len(response.content), response.status_code)
+            if trace is not None:
+                trace.addRequest(host, len(response.content), response.status_code)
+            if response.status_code == 200:
+                limiter.succeeded()
+                return response.json()
+            problem = 'HTTP ' + str(response.status_code)
+            if response.status_code not in RETRY_STATUS:
+                raise WikidataError(problem + ' for ' + url)
+
+        delay = backoff(attempt)
+        # The host asks us to slow down
+        if response is not None and response.status_code in [429, 503]:
+            limiter.throttled()
+            wait = retryAfter(response)
+            if wait is not None:
+                limiter.bucket.pause(wait)
+                delay = max(delay, wait)
+
+        if attempt >= MAX_RETRIES or not limiter.spendRetry():
+            raise WikidataError(problem + ' for ' + url + ' after ' + str(attempt + 1) + ' attempts')
+        # A retry that could only start after the deadline is not waited for
+        if deadline is not None and deadline.left() is not None and deadline.left() <= delay:
+            raise DeadlineExceeded('request')
+        pipeline_stats.addRetry(host)
+        if trace is not None:
+            trace.addRetry()
+        time.sleep(delay)
+        attempt += 1
+
+# Settings for the cache of wbsearchentities lookups (see getIDs)
+SEARCH_CACHE_FILE = 'search_cache.json'
+SEARCH_CACHE_SIZE = 20000
+SEARCH_CACHE_TTL = 30 * 24 * 60 * 60 # seconds, None means entries never expire
+
+'''Size-bounded LRU cache with per-entry expiry, optionally stored in a JSON file'''
+class LRUCache:
+    def __init__(self, path=None, max_size=10000, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Whether the entries changed since they were loaded or saved
+        self.changed = False
+        if path is not None:
+            self.load()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored = entry
+            if self.ttl is not None and time.time() - stored > self.ttl:
+                del self.entries[key]
+                self.changed = True
+                self.misses += 1
+                return default
+            # Mark as most recently used
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time())
+            self.entries.move_to_end(key)
+            self.changed = True
+            # Evict the least recently used entries
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        now = time.time()
+        with self.lock:
+            for key, value, stored_at in stored:
+                if self.ttl is None or now - stored_at <= self.ttl:
+                    self.entries[tuple(key)] = (value, stored_at)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # Only writes the file when the entries changed, so a run without lookups leaves it alone
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            if not self.changed:
+                return
+            stored = [[list(key), value, stored_at] for key, (value, stored_at) in self.entries.items()]
+            self.changed = False
+        # Write to a temporary file first, so an interrupted save keeps the old cache intact
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, self.path)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+search_cache = LRUCache(SEARCH_CACHE_FILE, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+atexit.register(search_cache.save)
+
+# Settings for the cache of SPARQL results (see getAnswer)
+SPARQL_CACHE_FILE = 'sparql_cache.sqlite'
+SPARQL_CACHE_SIZE = 200000
+SPARQL_CACHE_TTL = 7 * 24 * 60 * 60 # seconds, None means entries never expire
+# When read-only the cache is never changed, for repeatable runs (VASYSTEEM_SPARQL_CACHE=read-only)
+SPARQL_CACHE_READ_ONLY = os.environ.get('VASYSTEEM_SPARQL_CACHE', 'read-write') == 'read-only'
+SPARQL_CACHE_FLUSH_EVERY = 1000 # cache hits whose use time is kept in memory before it is written
+
+'''Returns the whitespace-normalized form of a query, used as cache key'''
+def normalizeQuery(query):
+    return ' '.join(query.split())
+
+'''Cache of SPARQL results stored in a SQLite file, with LRU eviction and per-entry expiry.
+In read-only mode entries never expire and nothing is written. The use times of hits are
+written in batches (see flush), so a hit does not wait for the disk. The file is opened
+on first use, so importing the module creates no files.'''
+class SparqlCache:
+    def __init__(self, path, max_size=100000, ttl=None, read_only=False):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        self.opened = False
+        self.size = 0
+        self.used = {}
+
+    # Opens the file on first use, the caller holds the lock
+    def open(self):
+        if self.opened:
+            return
+        self.opened = True
+        if self.read_only:
+            if os.path.exists(self.path):
+                self.db = sqlite3.connect('file:' + self.path + '?mode=ro', uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT, stored REAL, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self.db.commit()
+        if self.db is not None:
+            self.size = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def get(self, query):
+        key = normalizeQuery(query)
+        with self.lock:
+            self.open()
+            row = None
+            if self.db is not None:
+                row = self.db.execute('SELECT result, stored FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            result, stored = row
+            if not self.read_only:
+                now = time.time()
+                if self.ttl is not None and now - stored > self.ttl:
+                    self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self.db.commit()
+                    self.used.pop(key, None)
+                    self.size -= 1
+                    self.misses += 1
+                    return None
+                self.used[key] = now
+                if len(self.used) >= SPARQL_CACHE_FLUSH_EVERY:
+                    self.writeUsed()
+            self.hits += 1
+            return json.loads(result)
+
+    # Writes the use times kept in memory, the caller holds the lock
+    def writeUsed(self):
+        if self.used:
+            self.db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                [(used, key) for key, used in self.used.items()])
+            self.db.commit()
+            self.used = {}
+
+    def flush(self):
+        if self.read_only:
+            return
+        with self.lock:
+            if self.opened:
+                self.writeUsed()
+
+    def put(self, query, result):
+        if self.read_only:
+            return
+        key = normalizeQuery(query)
+        now = time.time()
+        with self.lock:
+            self.open()
+            existing = self.db.execute('SELECT 1 FROM results WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                            (key, json.dumps(result, separators=(',', ':')), now, now))
+            if existing is None:
+                self.size += 1
+            self.used.pop(key, None)
+            # Evict the least recently used results
+            if self.size > self.max_size:
+                self.writeUsed()
+                excess = self.size - self.max_size
+                self.db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+                self.size -= excess
+            self.db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+sparql_cache = SparqlCache(SPARQL_CACHE_FILE, SPARQL_CACHE_SIZE, SPARQL_CACHE_TTL, SPARQL_CACHE_READ_ONLY)
+atexit.register(sparql_cache.flush)
+
+'''Sends a query to the Wikidata endpoint and returns the result in compact form:
+{'boolean': ...} for ASK queries, {'vars': [...], 'rows': [[...], ...]} otherwise'''
+def fetchSparql(query):
     url = 'https://query.wikidata.org/sparql'
-    resultsx = requests.get(url, params={'query': query, 'format': 'json'})
-    
-    # To prevent a 429 request code (too many requests), wait 5 seconds when this occurs and try again.
-    if resultsx.status_code == 429:
-        time.sleep(5)
-        resultsx = requests.get(url, params={'query': query, 'format': 'json'})
+    results = request(url, {'query': query, 'format': 'json'})
+
+    # Check for yes/no answer
+    if 'boolean' in results.keys():
+        return {'boolean': results['boolean']}
+    varNames = results['head']['vars']
+    rows = []
+    for item in results['results']['bindings']:
+        rows.append([item[varName]['value'] if varName in item else None for varName in varNames])
+    return {'vars': varNames, 'rows': rows}
 
-    results = resultsx.json()
+'''Returns the (cached) compact result of a query'''
+def getResult(query):
+    results = sparql_cache.get(query)
+    if results is None:
+        results = fetchSparql(query)
+        sparql_cache.put(query, results)
+    return results
+
+'''Function to find answers to a given query'''
+def getAnswer(query): 
+    results = getResult(query)
 
     # Check for yes/no answer
     if 'boolean' in results.keys():
         return results['boolean'] 
     else:
         answers = []
-        varNames = results['head']['vars']
-        answerItems = results['results']['bindings']
-        
         # Loop through multiple answers (if given)
-        for item in answerItems: 
-            for varName in varNames:
-                answers.append(item[varName]['value'])
+        for row in results['rows']:
+            for value in row:
+                if value is not None:
+                    answers.append(value)
     
         return answers
 
+local_store = None
+local_store_lock = threading.Lock()
+
+'''Returns the offline knowledge store, opening it on first use'''
+def getStore():
+    global local_store
+    with local_store_lock:
+        if local_store is None:
+            import knowledge_store
+            local_store = knowledge_store.KnowledgeStore(LOCAL_STORE_FILE)
+    return local_store
+
+alias_index = None
+
+'''Returns the alias index, loading it on first use'''
+def getAliasIndex():
+    global alias_index
+    with local_store_lock:
+        if alias_index is None:
+            import alias_index as aliases
+            alias_index = aliases.load(ALIAS_INDEX_FILE)
+    return alias_index
+
+'''Returns the lemma of a text, used by the alias index when the plural rules find nothing'''
+def lemmatize(text):
+    return ' '.join(token.lemma_ for token in getNLP()(text))
+
+'''Returns ranked (ID, score) candidates for an animal name from the local alias index'''
+def linkEntities(query):
+    return getAliasIndex().lookup(query, lemmatizer=lemmatize)
+
 '''Function to find the IDs of a search query'''
-def getIDs(query, p=False):
+def getIDs(query, p=False, lang='nl'):
+    # Boolean questions can give a one-item list as search query
+    if isinstance(query, list):
+        query = query[-1]
+    if ENTITY_LINKER == 'local' and not p:
+        return [ID for ID, score in linkEntities(query)]
+    if p and property_labels is not None:
+        PIDs = property_labels.lookup(query)
+        if PIDs:
+            return PIDs
+    if BACKEND == 'local':
+        return getStore().search(query, lang, p)
+    # Earlier lookups are kept in the search cache
+    key = (query, lang, 'property' if p else 'item')
+    IDs = search_cache.get(key)
+    if IDs is not None:
+        return list(IDs)
+
     # Create parameters
     url = 'https://www.wikidata.org/w/api.php'
     params = {'action':'wbsearchentities',               
-              'language':'nl',
-              'uselang':'nl',
+              'language':lang,
+              'uselang':lang,
               'format':'json',
               'search': query}
     if p: # If looking for property id
         params['type'] = 'property'
-    json = requests.get(url,params).json()
+    json = request(url, params)
     # Get IDs from different answers
     IDs = []
     for search in json['search']:
         IDs.append(search['id'])
 
-    return IDs
+    search_cache.put(key, IDs)
+    return list(IDs)
+
+'''Fills the search cache with the lookups needed for the questions in a file'''
+def prewarmSearchCache(path):
+    for question_data in readQuestions(path):
+        question = questionText(question_data)
+        try:
+            keys, extra, lan_list = find_QP(question)
+            for qkey in keys['Q']:
+                getIDs(qkey)
+            getIDs(keys['P'], p=True)
+        except Exception as e:
+            recordError('prewarm', e)
+            continue
+
+    search_cache.save()
+    return search_cache.stats()
+
+# Words in a Dutch description that mark an item as an animal
+ANIMAL_DESCRIPTION_WORDS = ['dier', 'vogel', 'bird', 'insect', 'reptiel', 'amfibie', 'vissoort']
+ANIMAL_BATCH_SIZE = 200 # IDs per VALUES query
+ANIMAL_MEMO_SIZE = 100000 # IDs whose animal score is kept
+
+# Animal scores per ID, kept across questions
+animal_memo = LRUCache(max_size=ANIMAL_MEMO_SIZE)
+
+'''Returns the remembered animal scores of the IDs and the IDs that have none'''
+def knownAnimalScores(IDs):
+    scores = {}
+    unknown = []
+    for ID in dict.fromkeys(IDs):
+        score = animal_memo.get(ID)
+        if score is None:
+            unknown.append(ID)
+        else:
+            scores[ID] = score
+    return scores, unknown
+
+'''Returns the part of a Wikidata URI after the last slash (the ID)'''
+def uriID(uri):
+    return uri.rsplit('/', 1)[-1]
+
+'''Returns for every ID how many signals say it is an animal (0, 1 or 2):
+a Britannica code starting with 'animal' and an animal word in the Dutch description.
+All unknown IDs are looked up with one VALUES query per batch.'''
+def animalScores(IDs):
+    if BACKEND == 'local':
+        return {ID: getStore().animalScore(ID, ANIMAL_DESCRIPTION_WORDS) for ID in IDs}
+    scores, unknown = knownAnimalScores(IDs)
+
+    for i in range(0, len(unknown), ANIMAL_BATCH_SIZE):
+        batch = unknown[i:i + ANIMAL_BATCH_SIZE]
+        query = ('SELECT ?item ?code ?desc WHERE { VALUES ?item { ' + ' '.join('wd:' + ID for ID in batch) + ' } '
+                 'OPTIONAL { ?item wdt:P1417 ?code. } '
+                 'OPTIONAL { ?item schema:description ?desc. FILTER (langMatches(lang(?desc),"nl")) } }')
+        results = getResult(query)
+        signals = {ID: [False, False] for ID in batch}
+        for item, code, desc in results['rows']:
+            ID = uriID(item)
+            if ID not in signals:
+                continue
+            # If dictionary code starts with animal
+            if code is not None and code.startswith('animal'):
+                signals[ID][0] = True
+            # If an animal word is in the description, it probably is an animal
+            if desc is not None and any(word in desc.lower() for word in ANIMAL_DESCRIPTION_WORDS):
+                signals[ID][1] = True
+        for ID, (code_signal, desc_signal) in signals.items():
+            scores[ID] = int(code_signal) + int(desc_signal)
+            animal_memo.put(ID, scores[ID])
+
+    return {ID: scores[ID] for ID in IDs}
+
+'''Returns the IDs that are animals, ranked: in search order, or by animal score first
+(and then search order) when RANK_BY_CONFIDENCE is set'''
+def animalIDs(IDs):
+    scores = animalScores(IDs)
+    ranked = [ID for ID in IDs if scores[ID] > 0]
+    if RANK_BY_CONFIDENCE:
+        ranked.sort(key=lambda ID: -scores[ID])
+    return ranked
 
 '''To filter on animals. Returns boolean'''
 def animalID(ID):
-    query1 = 'SELECT ?ansLabel WHERE { wd:' + ID + ' wdt:P1417 ?ans. SERVICE wikibase:label { bd:serviceParam wikibase:language "nl,en". } }'
-    result1 = getAnswer(query1)
-    isAnimal = False
-    if result1 != []:
-        # If dictionary code starts with animal
-        if result1[0][:6] == 'animal':
-            isAnimal = True
-
-    query2 = 'SELECT ?ansLabel WHERE { wd:' + ID + ' schema:description ?ans. SERVICE wikibase:label { bd:serviceParam wikibase:language "nl,en". } FILTER (langMatches(lang(?ans),"nl")) }'
-    result2 = getAnswer(query2)
-    if result2 != []:
-        # If dier is in description, it probably is an animal.
-        if 'dier' or 'bird' in result2[0]:
-            isAnimal = True
-    return isAnimal
+    return animalScores([ID])[ID] > 0
 
 '''Removes articles 'de', 'het' and 'een' from the input'''
 def removeArticles(line):
@@ -82,9 +1043,71 @@ def removeArticles(line):
 
     return newLine
 
+'''A question parsed once by spaCy, with lookups by token text and position'''
+class ParsedQuestion:
+    def __init__(self, doc):
+        self.doc = doc
+        self.text = doc.text
+        self.question_type = None # set by find_QP
+        self.by_text = {}
+        self.children_of = {}
+        for token in doc:
+            self.by_text.setdefault(token.text, []).append(token)
+            # Punctuation is left out, as in a parse of the cleaned sentence
+            if token.text not in ['.', ',', '?', '!']:
+                self.children_of.setdefault(token.head.text, []).append(token.text)
+
+    def __getitem__(self, i):
+        return self.doc[i]
+
+    def __iter__(self):
+        return iter(self.doc)
+
+    def __len__(self):
+        return len(self.doc)
+
+    @property
+    def noun_chunks(self):
+        return self.doc.noun_chunks
+
+    def tokens(self, text):
+        return self.by_text.get(text, [])
+
+    def heads(self, text):
+        return [token.head.text for token in self.tokens(text)]
+
+    def children(self, text):
+        return list(self.children_of.get(text, []))
+
+    # For words that occur more than once, the last occurrence is used
+    def dep(self, text):
+        tokens = self.tokens(text)
+        return tokens[-1].dep_ if tokens else None
+
+    def pos(self, text):
+        tokens = self.tokens(text)
+        return tokens[-1].pos_ if tokens else None
+
+    def lemma(self, text):
+        tokens = self.tokens(text)
+        return tokens[-1].lemma_ if tokens else None
+
+'''Parses a question, unless it already is parsed'''
+def parseQuestion(question):
+    if isinstance(question, ParsedQuestion):
+        return question
+    with stage('nlp'):
+        return ParsedQuestion(getNLP()(question))
+
+'''Parses all questions at once with nlp.pipe'''
+def parseQuestions(questions, batch_size=NLP_BATCH_SIZE, n_process=NLP_PROCESSES):
+    with stage('nlp_batch'):
+        docs = getNLP().pipe(questions, batch_size=batch_size, n_process=n_process)
+        return [ParsedQuestion(doc) for doc in docs]
+
 '''Function to retreive the keywords to 'wat'-questions, based on the question given'''
 def getKeywords(question):
-    sentence = nlp(question)
+    sentence = parseQuestion(question)
     keywords = {
         'subject': '',
         'property': ''
@@ -113,37 +1136,19 @@ def rm_punct(sent):
 
 '''Returns POS of a given word within a sentence'''
 def find_pos(parse_sent, qword):
-    for word in parse_sent:
-        if word.text == qword:
-            funct = word.pos_
-
-    return funct
+    return parse_sent.pos(qword)
 
 '''Returns dependency of a given word within a sentence'''
 def find_dep(parse_sent, qword):
-    for word in parse_sent:
-        if word.text == qword:
-            funct = word.dep_
-
-    return funct
-
-'''Returns root, based on sentence and head word'''
-def find_root(sent, head):
-    parse = nlp(sent)
-    root = []
-    for word in parse:
-        if word.head.text == head:
-            root.append(word.text)
-    return root
-
-'''Returns head, based on sentence and root word'''
-def find_head(sent, root):
-    parse = nlp(sent)
-    head = []
-    for word in parse:
-        if word.text == root:
-            head.append(word.head.text)
-    return head
+    return parse_sent.dep(qword)
+
+'''Returns root, based on parsed sentence and head word'''
+def find_root(parse, head):
+    return parse.children(head)
+
+'''Returns head, based on parsed sentence and root word'''
+def find_head(parse, root):
+    return parse.heads(root)
 
 '''Returns a dependency analysis of a sentence'''
 def analyse(s):
@@ -152,273 +1157,426 @@ def analyse(s):
         anal_d[word.text] = word.dep_
     return anal_d
 
+# [HARDCODE] Synonyms/words per property category, used by categoryOf
+CAT_DICT = {
+    'kleur': [
+        'wit', 'zwart', 'rood', 'oranje', 
+        'paars', 'blauw', 'groen', 'geel',
+        'roze', 'kleur'
+    ],
+    'draagtijd': [
+        'draagtijd', 'zwanger', 'zwangerschap',
+        'dracht'
+    ],
+    'hoogte': [
+        'hoogte', 'lengte', 'grootte', 'lang',
+        'hoog', 'groot'
+    ],
+    'massa': [
+         'massa', 'gewicht', 'zwaarte'
+    ],
+    'gekarakteriseerd door': [
+        'herbivoor', 'carnivoor', 'omnivoor',
+        'gender'
+    ],
+    'snelheid': [
+        'snel'
+    ],
+    'wetenschappelijke naam': [
+        'wetenschappelijke naam'
+    ],
+    'bestudeerd door': [
+        'studie'
+    ],
+    'endemisch in': [
+        'herkomst', 'komen', 'vandaan'
+    ],
+    'belangrijkste voedselbron': [
+        'eten', 'voeden', 'voedsel',
+        'belangrijkste voedselbron'
+    ],
+}
+
+# Reverse index of the synonyms, built once: exact words and (synonym, category) pairs
+category_index = {}
+category_synonyms = []
+for cat, synonyms in CAT_DICT.items():
+    for val in synonyms:
+        category_index.setdefault(val, cat)
+        category_synonyms.append((val, cat))
+
 '''[HARDCODE] Returns synonyms/category of select words,
 if nothing in dict, it returns the input word'''
 def categoryOf(word):
-    cat_dict = {
-        'kleur': [
-            'wit', 'zwart', 'rood', 'oranje', 
-            'paars', 'blauw', 'groen', 'geel',
-            'roze', 'kleur'
-        ],
-        'draagtijd': [
-            'draagtijd', 'zwanger', 'zwangerschap',
-            'dracht'
-        ],
-        'hoogte': [
-            'hoogte', 'lengte', 'grootte', 'lang',
-            'hoog', 'groot'
-        ],
-        'massa': [
-             'massa', 'gewicht', 'zwaarte'
-        ],
-        'gekarakteriseerd door': [
-            'herbivoor', 'carnivoor', 'omnivoor',
-            'gender'
-        ],
-        'snelheid': [
-            'snel'
-        ],
-        'wetenschappelijke naam': [
-            'wetenschappelijke naam'
-        ],
-        'bestudeerd door': [
-            'studie'
-        ],
-        'endemisch in': [
-            'herkomst', 'komen', 'vandaan'
-        ],
-        'belangrijkste voedselbron': [
-            'eten', 'voeden', 'voedsel',
-            'belangrijkste voedselbron'
-        ],
-    }
+    if word in category_index:
+        return category_index[word]
+    # Otherwise the last synonym that contains the word
+    for val, cat in reversed(category_synonyms):
+        if word in val:
+            return cat
+    return word
 
-    found = False
-    for k,v in cat_dict.items():
-        for val in v:
-            if word in val or word == val:
-                cat = k
-                found = True
-    if not found:
-        cat = word
+# The property index is memory-mapped once, at startup
+property_labels = None
+if os.path.exists(PROPERTY_INDEX_FILE):
+    import property_index
+    property_labels = property_index.PropertyIndex(PROPERTY_INDEX_FILE)
 
-    return cat
+property_vectors = None
+property_vectors_lock = threading.Lock()
 
-'''Returns Q and P properties, based on a sentence'''
-def find_QP(sent):
-    sent_cl = rm_punct(sent)
+'''Returns the property labels and synonyms, what each one searches for,
+and a matrix with their normalized word vectors (one row per label)'''
+def getPropertyVectors():
+    global property_vectors
+    with property_vectors_lock:
+        if property_vectors is not None:
+            return property_vectors
+        labels = [val for val, cat in category_synonyms]
+        targets = [cat for val, cat in category_synonyms]
+        if property_labels is not None:
+            for label in property_labels.labels():
+                labels.append(label)
+                targets.append(label)
+
+        # The matrix is kept in a file, and made again when the model or the labels change
+        if os.path.exists(PROPERTY_VECTORS_FILE):
+            stored = numpy.load(PROPERTY_VECTORS_FILE)
+            if str(stored['model']) == SPACY_MODEL and list(stored['labels']) == labels:
+                property_vectors = (labels, targets, stored['matrix'])
+                return property_vectors
+
+        # Only the tokenizer is needed for the word vectors
+        nlp_model = getNLP()
+        matrix = numpy.array([nlp_model.make_doc(label).vector for label in labels], dtype=numpy.float32)
+        norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / numpy.where(norms == 0, 1, norms)
+        numpy.savez(PROPERTY_VECTORS_FILE, model=SPACY_MODEL, labels=numpy.array(labels), matrix=matrix)
+        property_vectors = (labels, targets, matrix)
+        return property_vectors
+
+'''Scores all content words of a question against all property labels at once.
+Returns the top-k (search key, score) pairs above the cutoff, best first.'''
+def matchProperties(question, exclude=(), k=SEMANTIC_TOP_K, cutoff=SEMANTIC_CUTOFF):
+    parse = parseQuestion(question)
+    labels, targets, matrix = getPropertyVectors()
+    tokens = [token for token in parse if token.pos_ in CONTENT_POS and token.has_vector and token.text not in exclude]
+    if tokens == [] or len(labels) == 0:
+        return []
+    vectors = numpy.array([token.vector for token in tokens], dtype=numpy.float32)
+    vectors = vectors / numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    # Best score of every label over all words of the question
+    scores = (vectors @ matrix.T).max(axis=0)
+
+    matches = []
+    for n in numpy.argsort(-scores):
+        if scores[n] < cutoff or len(matches) == k:
+            break
+        if targets[n] not in [target for target, score in matches]:
+            matches.append((targets[n], float(scores[n])))
+    return matches
+
+'''Returns True when a property key is known: a PID, a category, a property a question
+type fixes (FIXED_PROPERTIES) or an indexed label'''
+def knownProperty(key):
+    if re.match('P[0-9]+$', key) or key in CAT_DICT or key in FIXED_PROPERTIES:
+        return True
+    return property_labels is not None and property_labels.lookup(key) != []
+
+# Properties whose answers need a metric unit
+METRIC_PROPERTIES = [
+    'hoogte', 'lengte', 'breedte', 'massa',
+    'levensverwachting', 'hoogst geobserveerde levensduur',
+    'minimale frequentie van hoorbaar geluid', 
+    'maximale frequentie van hoorbaar geluid',
+    'hartslag', 'draagtijd', 'broedperiode', 'snelheid',
+    'spanwijdte'    ]
+
+'''A type of question: a regex (or a test on the parse) that recognises it, the handler
+that finds its Q and P, whether its answer needs a metric unit (None: decided by P), and
+the properties the handler chooses itself (of subjectHandler handlers, its P)'''
+class QuestionType:
+    def __init__(self, name, handler, pattern=None, test=None, unit=None, properties=()):
+        self.name = name
+        self.handler = handler
+        self.pattern = pattern
+        self.test = test
+        self.unit = unit
+        self.properties = list(properties)
+        if hasattr(handler, 'property'):
+            self.properties.append(handler.property)
+
+# Handlers get the parsed question and the question without punctuation,
+# they return the query dict, the extra dict and the language list
+
+# questions starting with 'welk(e)'
+def qpWelk(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if word == find_head(parse, word)[0]:
+            sent_ROOT = word
+    keys = find_root(parse, sent_ROOT)
+    keys.remove(sent_ROOT)
+    for word in keys:
+        for root in find_root(parse, word):
+            if root == parse[0].text: # parse[0] => .lemma.lower() == 'welk'
+                query_dict['P'] = categoryOf(word)
+            else:
+                query_dict['Q'] = [categoryOf(word)]
+    return query_dict, {}, []
+
+# questions on name of animal in other language
+def qpNameInLanguage(parse, sent_cl):
     query_dict = {}
-    extra_dict = {}
     lan_list = []
-    parse = nlp(sent)
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'nsubj':
+            d = getKeywords(parse)
+            query_dict['Q'] = [d['property']]
+            query_dict['P'] = 'triviale naam'
+        if find_dep(parse, word) == 'nmod':
+            result = langcodes.find(word)
+            lan_list = [str(result)]
+    return query_dict, {}, lan_list
 
-    # questions starting with 'welk(e)'
-    if parse[0].lemma_.lower() == 'welk':
-        for word in sent_cl.split():
-            if word == find_head(sent_cl, word)[0]:
-                sent_ROOT = word
-        keys = find_root(sent_cl, sent_ROOT)
-        keys.remove(sent_ROOT)
-        for word in keys:
-            for root in find_root(sent_cl, word):
-                if root == parse[0].text: # parse[0] => .lemma.lower() == 'welk'
-                    query_dict['P'] = categoryOf(word)
-                else:
-                    query_dict['Q'] = [categoryOf(word)]
-    # questions on name of animal in other language
-    elif re.match('Hoe heet.*in het.*', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'triviale naam'
-            if find_dep(parse, word) == 'nmod':
-                result = langcodes.find(word)
-                lan_list = [str(result)]
-    # "hoe groot kan [een dier] worden?"
-    elif re.match('Hoe groot kan.*worden?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'xcomp':
-                query_dict['Q'] = [categoryOf(word)]
-                query_dict['P'] = categoryOf('groot')
-    # "hoe lang is [een dier] zwanger?"
-    elif re.match('Hoe lang is.*zwanger?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'draagtijd'
-    # "hoe oud is de oudste [een dier] geworden?"
-    elif re.match('Hoe oud is de oudste.*geworden?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj' or find_dep(parse, word) == 'xcomp':
-                query_dict['Q'] = [categoryOf(word)]
-                query_dict['P'] = 'hoogst geobserveerde levensduur'
-    # "hoe oud wordt een [dier]?"
-    elif re.match('Hoe oud wordt.*?', sent):
+# "hoe groot kan [een dier] worden?"
+def qpMaxSize(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'xcomp':
+            query_dict['Q'] = [categoryOf(word)]
+            query_dict['P'] = categoryOf('groot')
+    return query_dict, {}, []
+
+'''Returns a handler that takes the subject keywords as Q, with a fixed P'''
+def subjectHandler(P):
+    def handler(parse, sent_cl):
+        query_dict = {}
         for word in sent_cl.split():
             if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
+                d = getKeywords(parse)
                 query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'levensverwachting'
-    # "Hoe zwaar is een [dier]?"
-    elif re.match('Hoe zwaar is.*', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                query_dict['Q'] = [categoryOf(word)]
-                query_dict['P'] = 'massa'
-            elif find_dep(parse, word) == 'amod':
-                if word == 'pasgeboren':
-                    extra_dict['Q'] = getIDs('geboortegewicht')[0]
-                    extra_dict['P'] = getIDs('van', p=True)[0]
-                if word == 'volwassen':
-                    extra_dict['Q'] = getIDs('volwassen gewicht')[0]
-                    extra_dict['P'] = getIDs('van', p=True)[0]
-                if word == 'mannelijke':
-                    extra_dict['Q'] = getIDs('mannelijk organisme')[0]
-                    extra_dict['P'] = getIDs('sekse of geslacht', p=True)[0]
-                if word == 'vrouwelijke':
-                    extra_dict['Q'] = getIDs('vrouwelijke organisme')[0]
-                    extra_dict['P'] = getIDs('sekse of geslacht', p=True)[0]
-    # questions starting with 'hoe'
-    elif parse[0].lemma_.lower() == 'hoe':
-        for word in sent_cl.split():
-            if word == find_head(sent_cl, word)[0]:
-                sent_ROOT = word
-                query_dict['P'] = categoryOf(sent_ROOT)
-            elif find_dep(parse, word) == 'nsubj':
-                query_dict['Q'] = [categoryOf(word)]
-    # Binary questions starting with verb (aux)
-    elif find_pos(parse, parse[0].text) == 'AUX':
-        Q2 = None
-        P = False
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'ROOT':
-                Q1 = word
-            elif word == find_head(sent_cl, word)[0]:
-                Q2 = word
+                query_dict['P'] = P
+        return query_dict, {}, []
+    handler.property = P
+    return handler
+
+# "hoe oud is de oudste [een dier] geworden?"
+def qpOldest(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'nsubj' or find_dep(parse, word) == 'xcomp':
+            query_dict['Q'] = [categoryOf(word)]
+            query_dict['P'] = 'hoogst geobserveerde levensduur'
+    return query_dict, {}, []
+
+# "Hoe zwaar is een [dier]?" and "Hoeveel weegt [een dier]?"
+def qpWeight(parse, sent_cl):
+    query_dict = {}
+    extra_dict = {}
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'nsubj':
+            query_dict['Q'] = [categoryOf(word)]
+            query_dict['P'] = 'massa'
+        elif find_dep(parse, word) == 'amod':
+            if word == 'pasgeboren':
+                extra_dict['Q'] = getIDs('geboortegewicht')[0]
+                extra_dict['P'] = getIDs('van', p=True)[0]
+            if word == 'volwassen':
+                extra_dict['Q'] = getIDs('volwassen gewicht')[0]
+                extra_dict['P'] = getIDs('van', p=True)[0]
+            if word == 'mannelijke':
+                extra_dict['Q'] = getIDs('mannelijk organisme')[0]
+                extra_dict['P'] = getIDs('sekse of geslacht', p=True)[0]
+            if word == 'vrouwelijke':
+                extra_dict['Q'] = getIDs('vrouwelijke organisme')[0]
+                extra_dict['P'] = getIDs('sekse of geslacht', p=True)[0]
+    return query_dict, extra_dict, []
+
+# questions starting with 'hoe'
+def qpHoe(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if word == find_head(parse, word)[0]:
+            sent_ROOT = word
+            query_dict['P'] = categoryOf(sent_ROOT)
+        elif find_dep(parse, word) == 'nsubj':
+            query_dict['Q'] = [categoryOf(word)]
+    return query_dict, {}, []
+
+# Binary questions starting with verb (aux)
+def qpBinary(parse, sent_cl):
+    query_dict = {}
+    Q2 = None
+    P = False
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'ROOT':
+            Q1 = word
+        elif word == find_head(parse, word)[0]:
+            Q2 = word
+            P1 = categoryOf(word)
+            P = True
+        else:
+            if word != categoryOf(word):
                 P1 = categoryOf(word)
                 P = True
-            else:
-                if word != categoryOf(word):
-                    P1 = categoryOf(word)
-                    P = True
-        if not P:
-            P1 = word
-        # For troubled cases
-        if Q2 == None:
-            for word in sent_cl.split():
-                if word != Q1:
-                    if word != P1:
-                        if word.lower() not in ['de', 'het', 'een']:
-                            if find_pos(parse, word) != 'AUX':
-                                Q2 = word
-        query_dict['Q'] = [Q1, Q2]
-        query_dict['P'] = P1
-    elif re.match('Waar is.*goed voor?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'gebruik'
-    elif re.match('Waar komt.*voor?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'endemisch in'
-    elif re.match('Hoeveel jongen krijgt.*?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'obj':
-                query_dict['Q'] = [categoryOf(word)]
-                query_dict['P'] = 'nestgrootte'
-    # "(sinds/vanaf) wanneer is [een dier] uitgestorven?"
-    elif re.match('(?:Sinds |Vanaf )?(W|w)anneer is.*uitgestorven?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'einddatum'
-    # "(sinds/vanaf) wanneer bestaat [een dier]?"
-    elif re.match('(?:Sinds |Vanaf )?(W|w)anneer bestaat.*?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'begindatum'
-    # "(sinds/vanaf) wanneer leeft [een dier]?"
-    elif re.match('(?:Sinds |Vanaf )?(W|w)anneer leeft.*?', sent):
+    if not P:
+        P1 = word
+    # For troubled cases
+    if Q2 == None:
         for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                query_dict['Q'] = [d['property']]
-                query_dict['P'] = 'begindatum'
-    # "behoort [een dier] tot de [klasse]?"
-    elif re.match('Behoort.*tot de.*?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                d = getKeywords(sent)
-                Q1 = [d['property']]
-            elif find_dep(parse, word) == 'obl':
-                Q2 = [categoryOf(word)]
-                query_dict['P'] = getIDs('subklasse van', p=True)[0]
-        query_dict['Q'] = [Q1, Q2]
-    # "eet [een dier] [eten]?"
-    elif re.match('Eet.*?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'amod':
-                Q1 = [categoryOf(word)]
-            elif find_dep(parse, word) == 'obj':
-                Q2 = [categoryOf(word)]
-                query_dict['P'] = getIDs('belangrijkste voedselbron', p=True)[0]
-        query_dict['Q'] = [Q1, Q2]
-    # "Hoeveel weegt [een dier]?"
-    elif re.match('Hoeveel weegt.*', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nsubj':
-                query_dict['Q'] = [categoryOf(word)]
-                query_dict['P'] = 'massa'
-            elif find_dep(parse, word) == 'amod':
-                if word == 'pasgeboren':
-                    extra_dict['Q'] = getIDs('geboortegewicht')[0]
-                    extra_dict['P'] = getIDs('van', p=True)[0]
-                if word == 'volwassen':
-                    extra_dict['Q'] = getIDs('volwassen gewicht')[0]
-                    extra_dict['P'] = getIDs('van', p=True)[0]
-                if word == 'mannelijke':
-                    extra_dict['Q'] = getIDs('mannelijk organisme')[0]
-                    extra_dict['P'] = getIDs('sekse of geslacht', p=True)[0]
-                if word == 'vrouwelijke':
-                    extra_dict['Q'] = getIDs('vrouwelijke organisme')[0]
-                    extra_dict['P'] = getIDs('sekse of geslacht', p=True)[0]
-    elif re.match('Wat is de.*naam van.*?', sent):
-        for word in sent_cl.split():
-            if find_dep(parse, word) == 'nmod':
-                d = getKeywords(sent)
-                query_dict['Q'] = [categoryOf(word)]
-                query_dict['P'] = 'triviale naam'
-            if find_dep(parse, word) == 'amod':
-                result = langcodes.find(word)
-                lan_list = [str(result)]
-
-    # questions starting with 'wat' / the rest
-    else: 
-        d = getKeywords(sent)
-        query_dict['Q'] = [d['subject']]
-        query_dict['P'] = d['property']
+            if word != Q1:
+                if word != P1:
+                    if word.lower() not in ['de', 'het', 'een']:
+                        if find_pos(parse, word) != 'AUX':
+                            Q2 = word
+    query_dict['Q'] = [Q1, Q2]
+    query_dict['P'] = P1
+    return query_dict, {}, []
+
+# "hoeveel jongen krijgt [een dier]?"
+def qpLitter(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'obj':
+            query_dict['Q'] = [categoryOf(word)]
+            query_dict['P'] = 'nestgrootte'
+    return query_dict, {}, []
+
+# "behoort [een dier] tot de [klasse]?"
+def qpSubclass(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'nsubj':
+            d = getKeywords(parse)
+            Q1 = [d['property']]
+        elif find_dep(parse, word) == 'obl':
+            Q2 = [categoryOf(word)]
+            query_dict['P'] = getIDs('subklasse van', p=True)[0]
+    query_dict['Q'] = [Q1, Q2]
+    return query_dict, {}, []
+
+# "eet [een dier] [eten]?"
+def qpEats(parse, sent_cl):
+    query_dict = {}
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'amod':
+            Q1 = [categoryOf(word)]
+        elif find_dep(parse, word) == 'obj':
+            Q2 = [categoryOf(word)]
+            query_dict['P'] = getIDs('belangrijkste voedselbron', p=True)[0]
+    query_dict['Q'] = [Q1, Q2]
+    return query_dict, {}, []
+
+# "wat is de [taal] naam van [een dier]?"
+def qpNameOf(parse, sent_cl):
+    query_dict = {}
+    lan_list = []
+    for word in sent_cl.split():
+        if find_dep(parse, word) == 'nmod':
+            d = getKeywords(parse)
+            query_dict['Q'] = [categoryOf(word)]
+            query_dict['P'] = 'triviale naam'
+        if find_dep(parse, word) == 'amod':
+            result = langcodes.find(word)
+            lan_list = [str(result)]
+    return query_dict, {}, lan_list
+
+# questions starting with 'wat' / the rest
+def qpRest(parse, sent_cl):
+    d = getKeywords(parse)
+    return {'Q': [d['subject']], 'P': d['property']}, {}, []
+
+# The question types, tried in this order. Types without a regex are tested on the parse.
+QUESTION_TYPES = [
+    QuestionType('welk', qpWelk, test=lambda parse: parse[0].lemma_.lower() == 'welk'),
+    QuestionType('naam in taal', qpNameInLanguage, 'Hoe heet.*in het.*', properties=['triviale naam']),
+    QuestionType('maximale grootte', qpMaxSize, 'Hoe groot kan.*worden?', unit=True),
+    QuestionType('draagtijd', subjectHandler('draagtijd'), 'Hoe lang is.*zwanger?', unit=True),
+    QuestionType('oudste', qpOldest, 'Hoe oud is de oudste.*geworden?', unit=True, properties=['hoogst geobserveerde levensduur']),
+    QuestionType('levensverwachting', subjectHandler('levensverwachting'), 'Hoe oud wordt.*?', unit=True),
+    QuestionType('hoe zwaar', qpWeight, 'Hoe zwaar is.*', unit=True, properties=['massa']),
+    QuestionType('hoe', qpHoe, test=lambda parse: parse[0].lemma_.lower() == 'hoe'),
+    QuestionType('ja/nee', qpBinary, test=lambda parse: find_pos(parse, parse[0].text) == 'AUX'),
+    QuestionType('gebruik', subjectHandler('gebruik'), 'Waar is.*goed voor?'),
+    QuestionType('herkomst', subjectHandler('endemisch in'), 'Waar komt.*voor?'),
+    QuestionType('jongen', qpLitter, 'Hoeveel jongen krijgt.*?', properties=['nestgrootte']),
+    QuestionType('uitgestorven', subjectHandler('einddatum'), '(?:Sinds |Vanaf )?(W|w)anneer is.*uitgestorven?'),
+    QuestionType('bestaat', subjectHandler('begindatum'), '(?:Sinds |Vanaf )?(W|w)anneer bestaat.*?'),
+    QuestionType('leeft', subjectHandler('begindatum'), '(?:Sinds |Vanaf )?(W|w)anneer leeft.*?'),
+    QuestionType('subklasse', qpSubclass, 'Behoort.*tot de.*?'),
+    QuestionType('eet', qpEats, 'Eet.*?'),
+    QuestionType('hoeveel weegt', qpWeight, 'Hoeveel weegt.*', unit=True, properties=['massa']),
+    QuestionType('naam van', qpNameOf, 'Wat is de.*naam van.*?', properties=['triviale naam']),
+    QuestionType('rest', qpRest, test=lambda parse: True),
+]
+
+# Properties the handlers choose themselves, these are never left to semantic matching
+FIXED_PROPERTIES = set(METRIC_PROPERTIES)
+for qtype in QUESTION_TYPES:
+    FIXED_PROPERTIES.update(qtype.properties)
+
+'''Compiles the question types into dispatch stages. Consecutive regex types become one
+alternation: the first alternative that matches is the first type in the list that matches.'''
+def compileRouter(question_types):
+    stages = []
+    for qtype in question_types:
+        if qtype.pattern is None:
+            stages.append((None, [qtype]))
+        elif stages and stages[-1][0] is not None:
+            stages[-1][0].append(qtype.pattern)
+            stages[-1][1].append(qtype)
+        else:
+            stages.append(([qtype.pattern], [qtype]))
+    router = []
+    for patterns, qtypes in stages:
+        if patterns is not None:
+            patterns = re.compile('|'.join('(?P<t' + str(n) + '>' + pattern + ')' for n, pattern in enumerate(patterns)))
+        router.append((patterns, qtypes))
+    return router
+
+question_router = compileRouter(QUESTION_TYPES)
+question_type_hits = {qtype.name: 0 for qtype in QUESTION_TYPES}
+question_type_lock = threading.Lock()
+
+'''Returns the type of a parsed question'''
+def routeQuestion(parse):
+    for pattern, qtypes in question_router:
+        if pattern is None:
+            qtype = qtypes[0]
+            if not qtype.test(parse):
+                continue
+        else:
+            match = pattern.match(parse.text)
+            if match is None:
+                continue
+            groups = match.groupdict()
+            qtype = qtypes[min(int(name[1:]) for name, value in groups.items() if value is not None)]
+        with question_type_lock:
+            question_type_hits[qtype.name] += 1
+        return qtype
+
+'''Returns how often every question type was recognised'''
+def questionTypeStats():
+    with question_type_lock:
+        return dict(question_type_hits)
+
+'''Returns Q and P properties, based on a sentence'''
+def find_QP(sent):
+    # The question is parsed only once, all lookups below use this parse
+    parse = parseQuestion(sent)
+    sent_cl = rm_punct(parse.text)
+    qtype = routeQuestion(parse)
+    parse.question_type = qtype.name
+    query_dict, extra_dict, lan_list = qtype.handler(parse, sent_cl)
     
     # Check whether or not there is need for a metric unit
-    if query_dict['P'] in [
-        'hoogte', 'lengte', 'breedte', 'massa',
-        'levensverwachting', 'hoogst geobserveerde levensduur',
-        'minimale frequentie van hoorbaar geluid', 
-        'maximale frequentie van hoorbaar geluid',
-        'hartslag', 'draagtijd', 'broedperiode', 'snelheid',
-        'spanwijdte'    ]:
+    if query_dict['P'] in METRIC_PROPERTIES:
         extra_dict['metricUnit'] = True
     else:
         extra_dict['metricUnit'] = False
+    if qtype.unit is not None:
+        extra_dict['metricUnit'] = qtype.unit
 
     return query_dict, extra_dict, lan_list
 
@@ -427,11 +1585,8 @@ def createQueries(qIDs, pIDs, extra, lan):
     qs = []
     if len(qIDs) == 1:
         qIDs = qIDs[0]
-        ID1s = []
         # Preventive check for animal IDs
-        for ID in qIDs:
-            if animalID(ID):
-                ID1s.append(ID)
+        ID1s = animalIDs(qIDs)
         # Generate queries based on differend ID combinations
         if list(extra.keys()) == ['metricUnit'] and lan == []:
             for ID1 in ID1s:
@@ -459,92 +1614,670 @@ def createQueries(qIDs, pIDs, extra, lan):
         qID1s = qIDs[0]
         qID2s = qIDs[1]
 
-        for qID1 in qID1s:
-            if animalID(qID1):
-                for qID2 in qID2s:
-                    for pID in pIDs:
-                        query = 'ASK { wd:' + qID1 + ' wdt:' + pID + ' wd:' + qID2 + ' . }'
-                        qs.append(query)
+        for qID1 in animalIDs(qID1s):
+            for qID2 in qID2s:
+                for pID in pIDs:
+                    query = 'ASK { wd:' + qID1 + ' wdt:' + pID + ' wd:' + qID2 + ' . }'
+                    qs.append(query)
 
     return qs
 
+'''Create one query for all ID combinations of a question, using VALUES blocks.
+Returns the query, the names of the variables that tag each result with its IDs,
+and the ID combinations in the order createQueries would use them. With a limit only
+the first limit combinations are asked for.'''
+def createQuery(qIDs, pIDs, extra, lan, limit=None):
+    label = 'SERVICE wikibase:label { bd:serviceParam wikibase:language "nl,en". }'
+    if len(qIDs) == 1:
+        # Preventive check for animal IDs
+        ID1s = animalIDs(qIDs[0])
+        if ID1s == [] or pIDs == []:
+            return None, [], []
+        if limit is not None:
+            # Only the items of the first limit combinations, item by item
+            ID1s = ID1s[:-(-limit // len(pIDs))]
+        items = 'VALUES ?item { ' + ' '.join('wd:' + ID1 for ID1 in ID1s) + ' } '
+        props = ('VALUES (?prop ?claim ?direct ?value ?simple) { '
+                 + ' '.join('(wd:' + ID2 + ' p:' + ID2 + ' wdt:' + ID2 + ' psv:' + ID2 + ' ps:' + ID2 + ')' for ID2 in pIDs)
+                 + ' } ')
+        tags = ['item', 'prop']
+        pairs = [(ID1, ID2) for ID1 in ID1s for ID2 in pIDs]
+        if list(extra.keys()) == ['metricUnit'] and lan == []:
+            if extra['metricUnit']:
+                query = 'SELECT ?item ?prop ?ansLabel ?unitLabel WHERE { ' + items + props + '?item ?claim ?x. ?x ?value ?node. ?node wikibase:quantityAmount ?ans. ?node wikibase:quantityUnit ?unit. ' + label + ' }'
+            else:
+                query = 'SELECT ?item ?prop ?ansLabel WHERE { ' + items + props + '?item ?direct ?ans. ' + label + ' }'
+        # Generate statement query
+        elif lan != []:
+            query = 'SELECT ?item ?label WHERE { ' + items + 'SERVICE wikibase:label { bd:serviceParam wikibase:language "' + lan[0] + '". ?item rdfs:label ?label. } }'
+            tags = ['item']
+            pairs = [(ID1,) for ID1 in ID1s for ID2 in pIDs]
+        else:
+            qualifier = '?statement pq:' + extra['P'] + ' wd:' + extra['Q'] + '. '
+            if extra['metricUnit']:
+                query = 'SELECT ?item ?prop ?statement ?ansLabel ?unitLabel WHERE { ' + items + props + '?item ?claim ?statement. ?statement ?value ?node. ?node wikibase:quantityUnit ?unit. ?statement ?simple ?ans. ' + qualifier + label + ' }'
+            else:
+                query = 'SELECT ?item ?prop ?statement ?ansLabel WHERE { ' + items + props + '?item ?direct ?statement. ?statement ?simple ?ans. ' + qualifier + label + ' }'
+    else: # Boolean question
+        qID1s = animalIDs(qIDs[0])
+        qID2s = qIDs[1]
+        if qID1s == [] or qID2s == [] or pIDs == []:
+            return None, [], []
+        if limit is not None:
+            qID1s = qID1s[:-(-limit // (len(qID2s) * len(pIDs)))]
+            if len(qID1s) == 1:
+                qID2s = qID2s[:-(-limit // len(pIDs))]
+        query = ('SELECT DISTINCT ?item ?target ?prop WHERE { '
+                 + 'VALUES ?item { ' + ' '.join('wd:' + qID1 for qID1 in qID1s) + ' } '
+                 + 'VALUES ?target { ' + ' '.join('wd:' + qID2 for qID2 in qID2s) + ' } '
+                 + 'VALUES (?prop ?direct) { ' + ' '.join('(wd:' + pID + ' wdt:' + pID + ')' for pID in pIDs) + ' } '
+                 + '?item ?direct ?target. }')
+        tags = ['item', 'target', 'prop']
+        pairs = [(qID1, qID2, pID) for qID1 in qID1s for qID2 in qID2s for pID in pIDs]
+
+    if limit is not None:
+        pairs = pairs[:limit]
+    return query, tags, pairs
+
+'''Runs a query made by createQuery and splits the results over the ID combinations.
+Returns one answer per combination, like getAnswer would for the separate queries.'''
+def planAnswers(query, tags, pairs):
+    if query is None:
+        return []
+    results = getResult(query)
+    varNames = results['vars']
+    tag_index = [varNames.index(tag) for tag in tags]
+    value_index = [n for n in range(len(varNames)) if varNames[n] not in tags]
+
+    groups = {}
+    for row in results['rows']:
+        key = tuple(uriID(row[n]) for n in tag_index)
+        values = groups.setdefault(key, [])
+        for n in value_index:
+            if row[n] is not None:
+                values.append(row[n])
+
+    # Combinations of a boolean question are true when they gave a result
+    if 'target' in tags:
+        return [pair in groups for pair in pairs]
+    return [groups.get(pair, []) for pair in pairs]
+
+'''Answers every ID combination from the offline store, in the order createQueries uses'''
+def localAnswers(qIDs, pIDs, extra, lan):
+    store = getStore()
+    if len(qIDs) == 1:
+        ID1s = animalIDs(qIDs[0])
+        if list(extra.keys()) == ['metricUnit'] and lan == []:
+            if extra['metricUnit']:
+                return [store.quantities(ID1, ID2) for ID1 in ID1s for ID2 in pIDs]
+            return [store.values(ID1, ID2) for ID1 in ID1s for ID2 in pIDs]
+        elif lan != []:
+            return [store.labels(ID1, lan[0]) for ID1 in ID1s for ID2 in pIDs]
+        return [store.qualified(ID1, ID2, extra['P'], extra['Q'], extra['metricUnit']) for ID1 in ID1s for ID2 in pIDs]
+    else: # Boolean question
+        return [store.ask(qID1, pID, qID2) for qID1 in animalIDs(qIDs[0]) for qID2 in qIDs[1] for pID in pIDs]
+
+# Settings of the batch planner (see planBatch)
+BATCH_PLANNING = True
+BATCH_ITEMS = 100 # items per VALUES query
+WBGETENTITIES_LIMIT = 50 # IDs per wbgetentities request
+BATCH_RESULTS_SIZE = 1000000
+
+# Settings for the cache of final answers, keyed on the parsed question (see answerKey)
+ANSWER_CACHE_FILE = 'answer_cache.json'
+ANSWER_CACHE_SIZE = 50000
+ANSWER_CACHE_TTL = 7 * 24 * 60 * 60 # seconds, None means entries never expire
+
+answer_cache = LRUCache(ANSWER_CACHE_FILE, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+atexit.register(answer_cache.save)
+
+# Answers of ID combinations resolved by the batch planner, keyed on (query variant, combination)
+batch_results = LRUCache(max_size=BATCH_RESULTS_SIZE)
+
+'''Turns the non-empty answers of the queries into the answer string'''
+def formatAnswers(answers, extra):
+    if len(answers) == 0:
+        return 'null'
+    else:
+        answer_given = False
+        for ans in answers:
+            if type(ans) == bool:
+                if not answer_given:
+                    if True in answers:
+                        answer_given = True
+                        return 'Ja'
+                    else:
+                        answer_given = True
+                        return 'Nee'
+            else:
+                ans_str = ''
+                if extra['metricUnit']:
+                    if len(ans) == 3:
+                        ans = ans[1:]
+                    for n in range(len(ans)):
+                        if n == 0 or n % 2 == 0:
+                            ans_str += ans[n]
+                            ans_str += ' '
+                            ans_str += ans[n+1]
+                        elif n != len(ans) - 1:
+                            ans_str += ', '
+                else:
+                    for ansLabel in ans:
+                        ans_str += ansLabel
+                        if ansLabel != ans[-1]:
+                            ans_str += ', '
+                return ans_str
+
+'''Raised when a stage of answering a question passes its deadline'''
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(stage)
+        self.stage = stage
+
+'''Deadline of one question. Every stage ends after its share of the budget (STAGE_BUDGETS),
+counted from the start, so time a stage does not use goes to the next ones.'''
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.started = time.monotonic()
+
+    def remaining(self, stage):
+        if self.budget is None:
+            return None
+        share = 0.0
+        for name, fraction in STAGE_BUDGETS.items():
+            share += fraction
+            if name == stage:
+                break
+        return max(0.0, self.started + self.budget * share - time.monotonic())
+
+    def check(self, stage):
+        if self.budget is not None and self.remaining(stage) <= 0:
+            raise DeadlineExceeded(stage)
+
+    # Seconds until the whole budget is used, None when there is no budget
+    def left(self):
+        if self.budget is None:
+            return None
+        return max(0.0, self.started + self.budget - time.monotonic())
+
+'''Waits for the futures of a stage. When the deadline passes first, the futures that
+did not start yet are cancelled and DeadlineExceeded is raised.'''
+def waitStage(futures, deadline, stage):
+    done, pending = wait(futures, timeout=deadline.remaining(stage))
+    if pending:
+        for future in pending:
+            future.cancel()
+        raise DeadlineExceeded(stage)
+    return [future.result() for future in futures]
+
+'''Finds the Q and P keys of a parsed question, and the property keys to search for.
+The result is kept on the parse, so the batch planner and the answering share it.'''
+def resolveKeys(parse):
+    if getattr(parse, 'resolved', None) is not None:
+        return parse.resolved
+    keys, extra, lan_list = find_QP(parse)
+    # Unknown property words are also searched as their closest property labels,
+    # after the word itself
+    p_keys = [keys['P']]
+    if SEMANTIC_MATCHING and not knownProperty(keys['P']):
+        q_words = ' '.join(str(qkey) for qkey in keys['Q']).split()
+        for target, score in matchProperties(parse, exclude=q_words):
+            if target not in p_keys:
+                p_keys.append(target)
+    parse.resolved = (keys, extra, lan_list, p_keys)
+    return parse.resolved
+
+'''Searches the subjects and the properties at the same time, returns their IDs'''
+def searchIDs(keys, p_keys, deadline=None):
+    q_searches = [query_pool.submit(traced(getIDs), qkey) for qkey in keys['Q']]
+    p_searches = [query_pool.submit(traced(getIDs), p_key, p=True) for p_key in p_keys]
+    if deadline is not None:
+        waitStage(q_searches + p_searches, deadline, 'search')
+    q_ids = [search.result() for search in q_searches]
+    p_ids = []
+    for search in p_searches:
+        for pID in search.result():
+            if pID not in p_ids:
+                p_ids.append(pID)
+    return q_ids, p_ids
+
+'''Returns the key of a question in the answer cache: its normalized Q terms, property
+keys, extra qualifier/metricUnit and languages (and the backend and entity linker that
+answer them, as these give different IDs)'''
+def answerKey(keys, extra, lan_list, p_keys):
+    def normal(term):
+        if isinstance(term, list):
+            return [normal(part) for part in term]
+        return ' '.join(str(term).lower().split())
+    canonical = [BACKEND, ENTITY_LINKER, normal(keys['Q']), normal(p_keys), sorted(extra.items()), lan_list]
+    return (json.dumps(canonical, ensure_ascii=False),)
+
+'''Returns True when the answers so far already decide the final answer: a True for a
+boolean question, or any non-empty answer otherwise (the first one in order is used)'''
+def acceptableAnswer(pair_answers):
+    for answer in pair_answers:
+        if answer is True or (not isinstance(answer, bool) and answer != []):
+            return True
+    return False
+
 '''Answers questions'''
 def answerQuestion(question):
+    return answerQuestionDetailed(question)[0]
+
+'''Answers a question within a time budget (seconds, None for no limit). Returns the
+answer and a reason code: 'complete', 'cached', 'partial:<stage>' when only part of the
+queries answered in time, 'deadline:<stage>' or 'error:<exception>'. The time per stage,
+the requests and the errors are recorded in the trace (a new one when none is given).'''
+def answerQuestionDetailed(question, budget=QUESTION_BUDGET, trace=None):
+    if trace is None:
+        trace = Trace(question.text if isinstance(question, ParsedQuestion) else question)
+    # Loading the model is not part of the time budget of a question
     try:
-        keys, extra, lan_list = find_QP(question)
-        q_ids = []
-        for qkey in keys['Q']:
-            q_ids.append(getIDs(qkey))
-        p_ids = getIDs(keys['P'], p=True)
+        loadModels()
+    except Exception:
+        # parseQuestion fails the same way, answerStages reports the error
+        pass
+    trace.deadline = Deadline(budget)
+    previous = activeTrace()
+    current_trace.trace = trace
+    try:
+        answer, reason = answerStages(question, trace.deadline, trace)
+    finally:
+        current_trace.trace = previous
+    trace.finish(reason)
+    recordTrace(trace)
+    return answer, reason
+
+'''The stages of answerQuestionDetailed'''
+def answerStages(question, deadline, trace):
+    try:
+        with stage('parse'):
+            parse = parseQuestion(question)
+            keys, extra, lan_list, p_keys = resolveKeys(parse)
+        trace.question_type = parse.question_type
+        # Differently worded questions with the same keys share their answer
+        answer_key = answerKey(keys, extra, lan_list, p_keys)
+        answer = answer_cache.get(answer_key)
+        if answer is not None:
+            return answer, 'cached'
+        with stage('search'):
+            q_ids, p_ids = searchIDs(keys, p_keys, deadline)
         lan = lan_list
-        queries = createQueries(q_ids, p_ids, extra, lan)
-        answers = []
-        for query in queries:
-            answer = getAnswer(query)
-            if answer != []:
-                answers.append(answer)
-        if len(answers) == 0:
-            return 'null'
+        if BACKEND == 'local':
+            with stage('values'):
+                pair_answers = localAnswers(q_ids, p_ids, extra, lan)
         else:
-            answer_given = False
-            for ans in answers:
-                if type(ans) == bool:
-                    if not answer_given:
-                        if True in answers:
-                            answer_given = True
-                            return 'Ja'
-                        else:
-                            answer_given = True
-                            return 'Nee'
-                else:
-                    ans_str = ''
-                    if extra['metricUnit']:
-                        if len(ans) == 3:
-                            ans = ans[1:]
-                        for n in range(len(ans)):
-                            if n == 0 or n % 2 == 0:
-                                ans_str += ans[n]
-                                ans_str += ' '
-                                ans_str += ans[n+1]
-                            elif n != len(ans) - 1:
-                                ans_str += ', '
-                    else:
-                        for ansLabel in ans:
-                            ans_str += ansLabel
-                            if ansLabel != ans[-1]:
-                                ans_str += ', '
-                    return ans_str
-    except:
-        return 'null'
+            # The animal checks are kept in animal_memo, createQuery(ies) reuses them
+            with stage('animal'):
+                waitStage([query_pool.submit(traced(animalScores), q_ids[0])], deadline, 'animal')
+            if QUERY_PLAN == 'single':
+                with stage('plan'):
+                    query, tags, pairs = createQuery(q_ids, p_ids, extra, lan, MAX_COMBINATIONS)
+                with stage('values'):
+                    pair_answers = batchAnswers(queryVariant(q_ids, extra, lan), pairs)
+                    if pair_answers is None:
+                        pair_answers = waitStage([query_pool.submit(traced(planAnswers), query, tags, pairs)], deadline, 'values')[0]
+            else:
+                with stage('plan'):
+                    queries = createQueries(q_ids, p_ids, extra, lan)
+                if MAX_COMBINATIONS is not None:
+                    queries = queries[:MAX_COMBINATIONS]
+                # The queries run in waves, in ranked order, until one gives an acceptable answer
+                pair_answers = []
+                with stage('values'):
+                    for i in range(0, len(queries), EARLY_EXIT_WAVE):
+                        futures = [query_pool.submit(traced(getAnswer), query) for query in queries[i:i + EARLY_EXIT_WAVE]]
+                        try:
+                            pair_answers += waitStage(futures, deadline, 'values')
+                        except DeadlineExceeded:
+                            # The best answer from the queries that did answer in time
+                            pair_answers += [future.result() for future in futures
+                                             if future.done() and not future.cancelled() and future.exception() is None]
+                            answers = [answer for answer in pair_answers if answer != []]
+                            return formatAnswers(answers, extra), 'partial:values'
+                        if acceptableAnswer(pair_answers):
+                            break
+        with stage('format'):
+            answers = []
+            for answer in pair_answers:
+                if answer != []:
+                    answers.append(answer)
+            answer = formatAnswers(answers, extra)
+        # A 'null' can be a missed search or a slow endpoint, so it is tried again next time
+        if answer != 'null':
+            answer_cache.put(answer_key, answer)
+        return answer, 'complete'
+    except DeadlineExceeded as e:
+        return 'null', 'deadline:' + e.stage
+    except Exception as e:
+        recordError('answer', e)
+        return 'null', 'error:' + type(e).__name__
 
-def main():
-    with open('evaluation.json', 'r', encoding='utf-8') as f:
-       questions = json.load(f)
+'''Returns the kind of query createQuery makes for a question. Answers of ID
+combinations are only shared between questions of the same kind.'''
+def queryVariant(qIDs, extra, lan):
+    if len(qIDs) != 1:
+        return ('boolean',)
+    if list(extra.keys()) == ['metricUnit'] and lan == []:
+        return ('values', extra['metricUnit'])
+    if lan != []:
+        return ('label', lan[0])
+    return ('qualifier', extra['P'], extra['Q'], extra['metricUnit'])
 
-    output = []
-    for question_data in questions:
-        question_id = question_data['id']
-        question_text = question_data['question']
-        answer = answerQuestion(question_text)
-        if answer != 'null':
-            correct = 1
+'''Returns the answers of the ID combinations of a question from the batch results,
+or None when the batch planner did not resolve all of them'''
+def batchAnswers(variant, pairs):
+    answers = []
+    for pair in pairs:
+        answer = batch_results.get((variant, pair))
+        if answer is None:
+            return None
+        answers.append(answer)
+    return answers
+
+'''Fills the animal scores of many IDs with wbgetentities, 50 IDs per request'''
+def animalScoresBulk(IDs):
+    unknown = knownAnimalScores(IDs)[1]
+    batches = [unknown[i:i + WBGETENTITIES_LIMIT] for i in range(0, len(unknown), WBGETENTITIES_LIMIT)]
+
+    def fetch(batch):
+        return request('https://www.wikidata.org/w/api.php', {'action': 'wbgetentities',
+                                                               'ids': '|'.join(batch),
+                                                               'props': 'descriptions|claims',
+                                                               'languages': 'nl',
+                                                               'format': 'json'})
+
+    for results in query_pool.map(fetch, batches):
+        for ID, entity in results.get('entities', {}).items():
+            score = 0
+            for claim in entity.get('claims', {}).get('P1417', []):
+                code = claim['mainsnak'].get('datavalue', {}).get('value')
+                if isinstance(code, str) and code.startswith('animal'):
+                    score += 1
+                    break
+            description = entity.get('descriptions', {}).get('nl', {}).get('value', '')
+            if any(word in description.lower() for word in ANIMAL_DESCRIPTION_WORDS):
+                score += 1
+            animal_memo.put(ID, score)
+
+'''Resolves a batch of parsed questions together, before they are answered: every
+distinct search once, the animal checks of all candidates with wbgetentities, and
+the value queries of all questions of the same kind with VALUES queries.
+answerQuestion then reads the answers from batch_results.'''
+def planBatch(parsed):
+    if BACKEND == 'local' or QUERY_PLAN != 'single':
+        return
+    resolved = []
+    for parse in parsed:
+        try:
+            resolved.append(resolveKeys(parse))
+        except Exception as e:
+            # This question is left to answerQuestion
+            recordError('batch', e)
+            continue
+
+    # Every distinct search once
+    searches = []
+    for keys, extra, lan_list, p_keys in resolved:
+        for qkey in keys['Q']:
+            searches.append((qkey[-1] if isinstance(qkey, list) else qkey, False))
+        for p_key in p_keys:
+            searches.append((p_key, True))
+    searches = list(dict.fromkeys(searches))
+
+    def search(key):
+        try:
+            getIDs(key[0], p=key[1])
+        except Exception as e:
+            # searchIDs below skips the question, answerQuestion searches again
+            recordError('batch', e)
+
+    list(query_pool.map(search, searches))
+
+    # Group the questions by kind of query, with all their candidate IDs.
+    # Boolean questions are not grouped, their combinations would multiply.
+    groups = {}
+    for n, (keys, extra, lan_list, p_keys) in enumerate(resolved):
+        try:
+            q_ids, p_ids = searchIDs(keys, p_keys)
+        except Exception as e:
+            recordError('batch', e)
+            continue
+        variant = queryVariant(q_ids, extra, lan_list)
+        group_key = (variant, n) if variant == ('boolean',) else (variant,)
+        group = groups.setdefault(group_key, {'variant': variant, 'extra': extra, 'lan': lan_list, 'items': [], 'targets': [], 'props': []})
+        group['items'] += q_ids[0]
+        if len(q_ids) > 1:
+            group['targets'] += q_ids[1]
+        group['props'] += p_ids
+
+    try:
+        animalScoresBulk([ID for group in groups.values() for ID in group['items']])
+    except WikidataError as e:
+        # The remaining animal checks are done by animalScores
+        recordError('batch', e)
+
+    # One VALUES query per kind of question (and batch of items)
+    jobs = []
+    for group in groups.values():
+        variant = group['variant']
+        try:
+            items = animalIDs(list(dict.fromkeys(group['items'])))
+        except Exception as e:
+            recordError('batch', e)
+            continue
+        targets = list(dict.fromkeys(group['targets']))
+        props = list(dict.fromkeys(group['props']))
+        for i in range(0, len(items), BATCH_ITEMS):
+            qIDs = [items[i:i + BATCH_ITEMS]]
+            if variant == ('boolean',):
+                qIDs.append(targets)
+            jobs.append((variant, createQuery(qIDs, props, group['extra'], group['lan'])))
+
+    def run(job):
+        variant, (query, tags, pairs) = job
+        try:
+            return variant, pairs, planAnswers(query, tags, pairs)
+        except Exception as e:
+            recordError('batch', e)
+            return variant, pairs, None
+
+    for variant, pairs, answers in query_pool.map(run, jobs):
+        if answers is not None:
+            for pair, answer in zip(pairs, answers):
+                batch_results.put((variant, pair), answer)
+
+'''Returns the aggregate statistics: histograms of the stages and of the questions per
+type, requests per host, cache hit rates and the recorded errors'''
+def metricsReport():
+    report = pipeline_stats.report()
+    report['caches'] = {
+        'search': search_cache.stats(),
+        'sparql': sparql_cache.stats(),
+        'answer': answer_cache.stats(),
+        'batch': batch_results.stats(),
+        'animal': animal_memo.stats()
+    }
+    report['question_type_hits'] = questionTypeStats()
+    report['startup'] = startupReport()
+    return report
+
+# Characters read at a time from a JSON list of questions
+READ_CHUNK_SIZE = 65536
+
+'''Yields the items of a JSON list one by one, without reading the whole file first'''
+def streamJSONList(f):
+    decoder = json.JSONDecoder()
+    buffer = f.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('not a JSON list')
+    buffer = buffer[1:]
+    while True:
+        # Skip the separators between items, reading on when the buffer runs out
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if not buffer:
+            more = f.read(READ_CHUNK_SIZE)
+            if not more:
+                raise ValueError('JSON list is not closed')
+            buffer += more
+            continue
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except ValueError:
+            # The item continues in the next chunk
+            more = f.read(READ_CHUNK_SIZE)
+            if not more:
+                raise
+            buffer += more
+            continue
+        yield item
+        buffer = buffer[end:]
+
+'''Yields the questions of a JSON list or JSONL file (one question per line), both are
+read as a stream'''
+def readQuestions(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            for question_data in streamJSONList(f):
+                yield question_data
         else:
-            correct = 0
-
-        print(question_text)
-        print(answer)
-        print('\t', correct)
-        print()
-    	
-        output.append({
-            "id": question_id,
-            "question": question_text,
-            "answer": answer,
-            "correct": correct
-        })
-    
-    with open('system.json', 'w', encoding='utf-8') as f:
+            # JSONL files are read line by line
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+'''Returns the question text, for both the evaluation ('question') and the testing ('string') format'''
+def questionText(question_data):
+    return question_data.get('question', question_data.get('string'))
+
+'''Yields lists of at most size items'''
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+'''Prints how many questions are done and how fast'''
+def reportProgress(done, started):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print('\r' + str(done) + ' questions, ' + format(rate, '.2f') + ' q/s', end='', file=sys.stderr, flush=True)
+
+'''Answers all questions of a file with a pool of workers. Results are written in input
+order to a checkpoint file, so an interrupted run continues where it stopped.
+The metrics of the run (see metricsReport) are written to metrics_path when given.'''
+def runEvaluation(in_path, out_path, workers=4, checkpoint_every=50, batch_size=NLP_BATCH_SIZE, n_process=NLP_PROCESSES, metrics_path=None, fork_workers=0):
+    checkpoint_path = out_path + '.partial'
+    output = []
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # A line cut off by the interruption is answered again
+                try:
+                    output.append(json.loads(line))
+                except ValueError:
+                    break
+    resumed = len(output)
+    # Rewrite the checkpoint without a possible cut-off last line
+    with open(checkpoint_path, 'w', encoding='utf-8') as f:
+        for record in output:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    warmup()
+    started = time.perf_counter()
+    questions = (question_data for n, question_data in enumerate(readQuestions(in_path)) if n >= resumed)
+    pending = []
+    if fork_workers > 0:
+        # Every worker process parses and answers whole questions. The caches they fill
+        # stay in the workers, only the answers come back.
+        pool = workerPool(fork_workers)
+        workers = fork_workers
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    with pool, open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+
+        def finish(question_data, future):
+            answer = future.result()
+            record = {
+                'id': question_data.get('id', len(output) + 1),
+                'question': questionText(question_data),
+                'answer': answer,
+                'correct': 1 if answer != 'null' else 0
+            }
+            output.append(record)
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + '\n')
+            done = len(output) - resumed
+            if done % checkpoint_every == 0:
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                search_cache.save()
+                sparql_cache.flush()
+                answer_cache.save()
+                reportProgress(done, started)
+
+        for chunk in chunked(questions, batch_size):
+            texts = [questionText(question_data) for question_data in chunk]
+            if fork_workers > 0:
+                # The workers parse the questions themselves
+                tasks = texts
+            else:
+                tasks = parseQuestions(texts, batch_size, n_process)
+                if BATCH_PLANNING:
+                    # The plan only fills batch_results, without it every question is answered on its own
+                    try:
+                        with stage('batch_plan'):
+                            planBatch(tasks)
+                    except Exception as e:
+                        recordError('batch', e)
+            for question_data, task in zip(chunk, tasks):
+                pending.append((question_data, pool.submit(answerQuestion, task)))
+            # Write the finished answers at the front, wait when too many are still running
+            while pending and (pending[0][1].done() or len(pending) > 4 * workers):
+                finish(*pending.pop(0))
+        while pending:
+            finish(*pending.pop(0))
+
+    reportProgress(len(output) - resumed, started)
+    print(file=sys.stderr)
+
+    with open(out_path, 'w', encoding='utf-8') as f:
         json.dump(output, f, indent=4)
+    os.remove(checkpoint_path)
+    if metrics_path is not None:
+        with open(metrics_path, 'w', encoding='utf-8') as f:
+            json.dump(metricsReport(), f, indent=4, ensure_ascii=False)
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(description='Answers the questions of a JSON or JSONL file')
+    parser.add_argument('input', nargs='?', default='evaluation.json')
+    parser.add_argument('output', nargs='?', default='system.json')
+    parser.add_argument('--workers', type=int, default=4, help='questions answered at the same time')
+    parser.add_argument('--checkpoint-every', type=int, default=50, help='questions between checkpoints')
+    parser.add_argument('--batch-size', type=int, default=NLP_BATCH_SIZE, help='questions parsed per nlp.pipe batch')
+    parser.add_argument('--processes', type=int, default=NLP_PROCESSES, help='processes used for parsing')
+    parser.add_argument('--fork-workers', type=int, default=0,
+                        help='answer the questions in this many forked processes that share the loaded model, instead of threads')
+    parser.add_argument('--trace', help='JSONL file that gets the trace of every question')
+    parser.add_argument('--metrics', help='JSON file that gets the stage histograms, request counts and cache hit rates')
+    args = parser.parse_args()
+
+    global TRACE_FILE
+    TRACE_FILE = args.trace
+    runEvaluation(args.input, args.output, args.workers, args.checkpoint_every, args.batch_size, args.processes, args.metrics, args.fork_workers)
+
+startup_times['import'] = time.perf_counter() - import_started
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,228 @@
+import mmap
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+
+INDEX_VERSION = 1
+HEADER = 'VASYSTEEM-ALIASES'
+
+# Scores of the different kinds of matches
+EXACT_SCORE = 1.0
+LEMMA_SCORE = 0.9
+FUZZY_SCORE = 0.8 # minus a penalty per edit
+MAX_RESULTS = 7
+
+'''Normalizes a surface form: lower case, no accents, no 's plural endings (koala's),
+hyphens and other apostrophes as spaces'''
+def normalize(text):
+    text = re.sub(r"(?<=\w)['’]s\b", '', text)
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    for char in ['-', "'", '’']:
+        text = text.replace(char, ' ')
+    return ' '.join(text.split())
+
+'''Returns possible singular forms of a Dutch (or English) plural, the word itself first'''
+def baseForms(word):
+    forms = [word]
+    last = word.split(' ')[-1]
+    rest = word[:len(word) - len(last)]
+    candidates = []
+    if last.endswith('s'):
+        # olifants -> olifant, orang oetangs -> orang oetang
+        candidates.append(last[:-1])
+    if last.endswith('en'):
+        stem = last[:-2]
+        candidates.append(stem)
+        # katten -> kat
+        if len(stem) > 2 and stem[-1] == stem[-2]:
+            candidates.append(stem[:-1])
+        # wolven -> wolf, muizen -> muis
+        if stem.endswith('v'):
+            candidates.append(stem[:-1] + 'f')
+        if stem.endswith('z'):
+            candidates.append(stem[:-1] + 's')
+        # beren -> beer, apen -> aap
+        if len(stem) > 1 and stem[-2] in 'aeou' and stem[-1] not in 'aeiou':
+            candidates.append(stem[:-1] + stem[-2] + stem[-1])
+    if last.endswith('eren'):
+        # kinderen -> kind, kalveren -> kalf, lammeren -> lam
+        stem = last[:-4]
+        candidates.append(stem)
+        if stem.endswith('v'):
+            candidates.append(stem[:-1] + 'f')
+        if len(stem) > 2 and stem[-1] == stem[-2]:
+            candidates.append(stem[:-1])
+    for candidate in candidates:
+        form = rest + candidate
+        if len(candidate) > 1 and form not in forms:
+            forms.append(form)
+    return forms
+
+'''Returns the maximum number of edits allowed for a word of this length'''
+def maxEdits(word):
+    if len(word) <= 4:
+        return 0
+    if len(word) <= 7:
+        return 1
+    return 2
+
+'''Writes the index file from (form, ID) pairs sorted on the UTF-8 bytes of the normalized
+form: one line per form with its IDs in the order of the pairs. Returns the number of forms.'''
+def write(path, pairs):
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(HEADER + ' ' + str(INDEX_VERSION) + ' ' + time.strftime('%Y-%m-%d') + '\n')
+        form = None
+        IDs = []
+        for next_form, ID in pairs:
+            if next_form != form:
+                if IDs:
+                    f.write(form + '\t' + ','.join(IDs) + '\n')
+                    count += 1
+                form = next_form
+                IDs = []
+            if form and ID not in IDs:
+                IDs.append(ID)
+        if IDs:
+            f.write(form + '\t' + ','.join(IDs) + '\n')
+            count += 1
+    return count
+
+'''Read-only, memory-mapped index from normalized surface forms to QIDs, made by build().
+The sorted lines work as a trie: all forms with a prefix are one range of lines. Lookups
+are exact, plural/lemma and edit-distance, and return ranked (QID, score) candidates.'''
+class AliasIndex:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self.data[:self.data.find(b'\n')].decode('utf-8').split()
+        if len(header) < 2 or header[0] != HEADER or int(header[1]) != INDEX_VERSION:
+            raise ValueError(path + ' is not a version ' + str(INDEX_VERSION) + ' alias index')
+        self.version = int(header[1])
+        self.built = header[2] if len(header) > 2 else None
+        self.start = self.data.find(b'\n') + 1
+
+    '''Returns (form, IDs, position of the next line) of the line at position'''
+    def entry(self, position):
+        end = self.data.find(b'\n', position)
+        form, IDs = self.data[position:end].split(b'\t', 1)
+        return form, IDs, end + 1
+
+    '''Returns the position of the first line between low and high (line starts) whose
+    form is not below the key (bytes)'''
+    def lowerBound(self, key, low=None, high=None):
+        low = self.start if low is None else low
+        high = len(self.data) if high is None else high
+        # Binary search over byte positions, every probe is moved to the start of its line
+        while low < high:
+            middle = (low + high) // 2
+            begin = self.data.rfind(b'\n', self.start - 1, middle) + 1
+            form, IDs, after = self.entry(begin)
+            if form < key:
+                low = after
+            else:
+                high = begin
+        return low
+
+    def exact(self, form):
+        key = form.encode('utf-8')
+        position = self.lowerBound(key)
+        if position < len(self.data):
+            line_form, IDs, after = self.entry(position)
+            if line_form == key:
+                return IDs.decode('utf-8').split(',')
+        return []
+
+    '''Yields (IDs, edits) of all forms within max_edits of the word (Levenshtein, walking
+    the prefix ranges of the sorted forms like the nodes of a trie)'''
+    def fuzzy(self, word, max_edits):
+        first_row = list(range(len(word) + 1))
+        stack = [('', first_row, self.start, len(self.data))]
+        while stack:
+            prefix, row, position, end = stack.pop()
+            key = prefix.encode('utf-8')
+            # A form equal to the prefix is the first line of its range
+            if position < end:
+                form, IDs, after = self.entry(position)
+                if form == key:
+                    if row[-1] <= max_edits:
+                        yield IDs.decode('utf-8').split(','), row[-1]
+                    position = after
+            while position < end:
+                char = self.entry(position)[0].decode('utf-8')[len(prefix)]
+                # The forms that continue with this character end before prefix + char + 0xff,
+                # a byte that does not occur in UTF-8
+                child_end = self.lowerBound(key + char.encode('utf-8') + b'\xff', position, end)
+                new_row = [row[0] + 1]
+                for n in range(1, len(word) + 1):
+                    cost = 0 if word[n - 1] == char else 1
+                    new_row.append(min(new_row[n - 1] + 1, row[n] + 1, row[n - 1] + cost))
+                # Only continue when some prefix is still close enough
+                if min(new_row) <= max_edits:
+                    stack.append((prefix + char, new_row, position, child_end))
+                position = child_end
+
+    '''Returns ranked (ID, score) candidates for a surface form. The lemmatizer is an
+    optional function that gives the lemma of a text, tried when plural rules find nothing.'''
+    def lookup(self, text, lemmatizer=None, limit=MAX_RESULTS):
+        word = normalize(text)
+        scores = {}
+
+        def found(IDs, score):
+            for ID in IDs:
+                if score > scores.get(ID, 0):
+                    scores[ID] = score
+
+        found(self.exact(word), EXACT_SCORE)
+        for form in baseForms(word)[1:]:
+            found(self.exact(form), LEMMA_SCORE)
+        if not scores and lemmatizer is not None:
+            lemma = normalize(lemmatizer(text))
+            if lemma != word:
+                found(self.exact(lemma), LEMMA_SCORE)
+        if not scores:
+            for form in baseForms(word):
+                edits = maxEdits(form)
+                if edits > 0:
+                    for IDs, distance in self.fuzzy(form, edits):
+                        found(IDs, FUZZY_SCORE - 0.1 * distance)
+
+        # Higher scores first, ties keep the order in which they were found
+        order = {ID: n for n, ID in enumerate(scores)}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], order[item[0]]))
+        return ranked[:limit]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+'''Opens an index made by build()'''
+def load(path):
+    return AliasIndex(path)
+
+'''Builds the index file from the Dutch and English labels and aliases of the items in a
+knowledge store (see knowledge_store.py); labels come before aliases. The forms are
+sorted in a temporary SQLite database, so the build does not hold them in memory.'''
+def build(store_path, index_path, languages=('nl', 'en')):
+    db = sqlite3.connect('file:' + store_path + '?mode=ro', uri=True)
+    marks = ', '.join('?' for lang in languages)
+    rows = db.execute('SELECT id, label FROM labels WHERE id LIKE \'Q%\' AND lang IN (' + marks + ') '
+                      'ORDER BY alias, rowid', languages)
+    # An empty name gives a temporary database on disk
+    forms = sqlite3.connect('')
+    forms.execute('CREATE TABLE forms (form TEXT, id TEXT)')
+    forms.executemany('INSERT INTO forms VALUES (?, ?)', ((normalize(label), ID) for ID, label in rows))
+    db.close()
+    # Text is compared on its UTF-8 bytes (BINARY collation), the order of the file
+    count = write(index_path, forms.execute('SELECT form, id FROM forms ORDER BY form, rowid'))
+    forms.close()
+    return count
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print('usage: python alias_index.py build <store.sqlite> <aliases.idx>')
+        sys.exit(1)
+    print(str(build(sys.argv[2], sys.argv[3])) + ' surface forms')
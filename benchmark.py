@@ -0,0 +1,247 @@
+import argparse
+import json
+import math
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import VAsysteem
+
+RECORDING_FILE = 'recording.sqlite'
+PERCENTILES = [50, 90, 99]
+
+'''Response served from a recording, with the parts of requests.Response that request() uses'''
+class RecordedResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+'''Stand-in for session.get. 'record' sends the requests to Wikidata and stores the
+responses, 'replay' only serves stored responses (a missing one is a 404), 'live'
+only counts the requests.'''
+class Recording:
+    def __init__(self, path, mode, get):
+        self.mode = mode
+        self.live_get = get
+        self.requests = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if mode != 'live':
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER, content BLOB)')
+            self.db.commit()
+
+    '''The URL with its parameters in sorted order'''
+    def key(self, url, params):
+        return url + '?' + urlencode(sorted((params or {}).items()))
+
+    def get(self, url, params=None, timeout=None):
+        with self.lock:
+            self.requests += 1
+        if self.mode == 'live':
+            return self.live_get(url, params=params, timeout=timeout)
+        key = self.key(url, params)
+        with self.lock:
+            row = self.db.execute('SELECT status, content FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return RecordedResponse(row[0], bytes(row[1]))
+        if self.mode == 'replay':
+            with self.lock:
+                self.misses += 1
+            return RecordedResponse(404, b'{}')
+        response = self.live_get(url, params=params, timeout=timeout)
+        # Only good responses are kept, throttled and failed requests are retried live
+        if response.status_code == 200:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', (key, response.status_code, response.content))
+                self.db.commit()
+        return response
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+'''Sends the HTTP requests of VAsysteem through the recording. Replayed requests are
+not rate limited or hedged, they do not reach Wikidata.'''
+def install(recording):
+    VAsysteem.session.get = recording.get
+    if recording.mode == 'replay':
+        VAsysteem.REQUESTS_PER_SECOND = {}
+        VAsysteem.DEFAULT_REQUESTS_PER_SECOND = 1000000.0
+        VAsysteem.HEDGE_AFTER = {}
+        VAsysteem.host_limiters.clear()
+
+'''Replaces the caches by empty in-memory ones, so every run starts from the same state'''
+def freshCaches():
+    VAsysteem.search_cache = VAsysteem.LRUCache(None, VAsysteem.SEARCH_CACHE_SIZE, VAsysteem.SEARCH_CACHE_TTL)
+    VAsysteem.sparql_cache = VAsysteem.SparqlCache(':memory:', VAsysteem.SPARQL_CACHE_SIZE, VAsysteem.SPARQL_CACHE_TTL)
+    VAsysteem.answer_cache = VAsysteem.LRUCache(None, VAsysteem.ANSWER_CACHE_SIZE, VAsysteem.ANSWER_CACHE_TTL)
+    VAsysteem.batch_results = VAsysteem.LRUCache(max_size=VAsysteem.BATCH_RESULTS_SIZE)
+    VAsysteem.animal_memo = VAsysteem.LRUCache(max_size=VAsysteem.ANIMAL_MEMO_SIZE)
+
+'''Returns the p-th percentile of the values (nearest rank)'''
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+'''Returns the percentiles of the values, by name'''
+def percentiles(values):
+    return {'p' + str(p): percentile(values, p) for p in PERCENTILES}
+
+'''Normalizes an answer for comparing it to the gold answer'''
+def normalize(text):
+    return ' '.join(str(text).lower().replace(',', ' ').split())
+
+'''Returns (exact, overlap): whether the answer has exactly the gold strings, and
+whether it has at least one of them. List answers are separated by commas.'''
+def score(answer, gold):
+    if answer == 'null' or not gold:
+        return False, False
+    given = set(normalize(part) for part in answer.split(', ') if part.strip())
+    wanted = set(normalize(item['string']) for item in gold)
+    return given == wanted, len(given & wanted) > 0
+
+'''Returns the peak memory of the process in MB (ru_maxrss), or None when unknown'''
+def peakMemory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+'''Answers the questions of a testing file and reports speed, stage latencies,
+requests, memory and accuracy'''
+def runBenchmark(path, recording, workers=1, limit=None, batch_planning=False, trace_memory=False):
+    questions = list(VAsysteem.readQuestions(path))
+    if limit is not None:
+        questions = questions[:limit]
+    VAsysteem.warmup()
+    if trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    parsed = VAsysteem.parseQuestions([VAsysteem.questionText(question_data) for question_data in questions])
+    parse_seconds = time.perf_counter() - started
+    if batch_planning:
+        VAsysteem.planBatch(parsed)
+
+    def answer(parse):
+        trace = VAsysteem.Trace(parse.text)
+        answer, reason = VAsysteem.answerQuestionDetailed(parse, trace=trace)
+        return answer, trace
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(answer, parsed))
+    seconds = time.perf_counter() - started
+
+    stages = {}
+    latencies = []
+    requests = []
+    reasons = {}
+    exact = 0
+    overlap = 0
+    answered = 0
+    failures = []
+    for question_data, (answer, trace) in zip(questions, results):
+        for name, stage_seconds in trace.stages.items():
+            stages.setdefault(name, []).append(stage_seconds)
+        latencies.append(trace.seconds)
+        requests.append(sum(trace.requests.values()))
+        reason = trace.reason.split(':')[0]
+        reasons[reason] = reasons.get(reason, 0) + 1
+        is_exact, is_overlap = score(answer, question_data.get('answer', []))
+        exact += is_exact
+        overlap += is_overlap
+        answered += answer != 'null'
+        if not is_exact:
+            failures.append({'question': trace.question, 'answer': answer, 'reason': trace.reason,
+                             'gold': [item['string'] for item in question_data.get('answer', [])]})
+
+    count = len(questions)
+    report = {
+        'questions': count,
+        'seconds': seconds,
+        'questions_per_second': count / seconds if seconds > 0 else None,
+        'parse_seconds': parse_seconds,
+        'latency': percentiles(latencies),
+        'stages': {name: percentiles(values) for name, values in stages.items()},
+        'requests': {
+            'total': recording.requests,
+            'per_question': recording.requests / count if count else None,
+            'traced_per_question': percentiles(requests),
+            'replay_misses': recording.misses
+        },
+        'reasons': reasons,
+        'accuracy': {
+            'answered': answered / count if count else None,
+            'exact': exact / count if count else None,
+            'overlap': overlap / count if count else None
+        },
+        'peak_memory_mb': peakMemory(),
+        'failures': failures
+    }
+    if trace_memory:
+        report['peak_traced_memory_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return report
+
+'''Prints the main numbers of a report'''
+def printSummary(report):
+    def seconds(value):
+        return format(value * 1000, '.1f') + ' ms' if value is not None else '-'
+    print(str(report['questions']) + ' questions in ' + format(report['seconds'], '.2f') + ' s, '
+          + format(report['questions_per_second'] or 0, '.2f') + ' q/s', file=sys.stderr)
+    print('latency ' + ', '.join(name + ' ' + seconds(value) for name, value in report['latency'].items()), file=sys.stderr)
+    for stage, values in report['stages'].items():
+        print('  ' + stage + ': ' + ', '.join(name + ' ' + seconds(value) for name, value in values.items()), file=sys.stderr)
+    print('requests per question ' + format(report['requests']['per_question'] or 0, '.2f')
+          + ' (' + str(report['requests']['replay_misses']) + ' not in the recording)', file=sys.stderr)
+    accuracy = report['accuracy']
+    print('answered ' + format(accuracy['answered'] or 0, '.1%') + ', exact ' + format(accuracy['exact'] or 0, '.1%')
+          + ', overlap ' + format(accuracy['overlap'] or 0, '.1%'), file=sys.stderr)
+    if report['peak_memory_mb'] is not None:
+        print('peak memory ' + format(report['peak_memory_mb'], '.0f') + ' MB', file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks speed and accuracy on a testing file')
+    parser.add_argument('input', nargs='?', default='testing.json')
+    parser.add_argument('--mode', choices=['record', 'replay', 'live'], default='replay',
+                        help='record the Wikidata responses, replay recorded ones or use Wikidata directly')
+    parser.add_argument('--recording', default=RECORDING_FILE, help='SQLite file with the recorded responses')
+    parser.add_argument('--workers', type=int, default=1, help='questions answered at the same time')
+    parser.add_argument('--limit', type=int, help='only the first questions of the file')
+    parser.add_argument('--batch-planning', action='store_true', help='plan the queries of all questions together first')
+    parser.add_argument('--warm-caches', action='store_true', help='keep the search, SPARQL and answer caches')
+    parser.add_argument('--tracemalloc', action='store_true', help='also measure the peak of Python allocations (slower)')
+    parser.add_argument('--report', help='JSON file that gets the full report')
+    args = parser.parse_args()
+
+    recording = Recording(args.recording, args.mode, VAsysteem.session.get)
+    install(recording)
+    if not args.warm_caches:
+        freshCaches()
+    try:
+        report = runBenchmark(args.input, recording, args.workers, args.limit, args.batch_planning, args.tracemalloc)
+    finally:
+        recording.close()
+
+    printSummary(report)
+    if args.report is not None:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
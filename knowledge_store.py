@@ -0,0 +1,267 @@
+import bz2
+import gzip
+import json
+import sqlite3
+import sys
+
+# Items that are taxa (instance of taxon) or have a Britannica animal code are kept
+TAXON = 'Q16521'
+ENTITY_URI = 'http://www.wikidata.org/entity/'
+SEARCH_LIMIT = 7 # the default limit of wbsearchentities
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS labels (id TEXT, lang TEXT, label TEXT, norm TEXT, alias INTEGER);
+CREATE TABLE IF NOT EXISTS descriptions (id TEXT, lang TEXT, description TEXT);
+CREATE TABLE IF NOT EXISTS statements (statement TEXT, subject TEXT, property TEXT, rank TEXT,
+                                       value TEXT, amount TEXT, unit TEXT);
+CREATE TABLE IF NOT EXISTS qualifiers (statement TEXT, property TEXT, value TEXT);
+'''
+
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS labels_id ON labels (id, lang);
+CREATE INDEX IF NOT EXISTS labels_norm ON labels (norm);
+CREATE INDEX IF NOT EXISTS descriptions_id ON descriptions (id, lang);
+CREATE INDEX IF NOT EXISTS statements_subject ON statements (subject, property);
+CREATE INDEX IF NOT EXISTS qualifiers_statement ON qualifiers (statement, property);
+'''
+
+'''Opens a (compressed) Wikidata JSON dump and yields its entities'''
+def readDump(path):
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rt', encoding='utf-8')
+    elif path.endswith('.bz2'):
+        f = bz2.open(path, 'rt', encoding='utf-8')
+    else:
+        f = open(path, 'r', encoding='utf-8')
+    with f:
+        for line in f:
+            # Every entity is on its own line, between '[' and ']' and followed by a comma
+            line = line.strip().rstrip(',')
+            if line in ['[', ']', '']:
+                continue
+            yield json.loads(line)
+
+'''Returns the values of the main snaks of a property'''
+def claimValues(entity, prop):
+    values = []
+    for claim in entity.get('claims', {}).get(prop, []):
+        datavalue = claim['mainsnak'].get('datavalue')
+        if datavalue is not None:
+            values.append(datavalue['value'])
+    return values
+
+'''Returns True for taxa and for items with a Britannica animal code'''
+def isAnimalEntity(entity):
+    for value in claimValues(entity, 'P31'):
+        if isinstance(value, dict) and value.get('id') == TAXON:
+            return True
+    for value in claimValues(entity, 'P1417'):
+        if isinstance(value, str) and value.startswith('animal'):
+            return True
+    return False
+
+'''Returns a snak value as (value, amount, unit), in the form the SPARQL endpoint gives it'''
+def snakValue(snak):
+    datavalue = snak.get('datavalue')
+    if datavalue is None:
+        return None, None, None
+    value = datavalue['value']
+    kind = datavalue['type']
+    if kind == 'wikibase-entityid':
+        return value['id'], None, None
+    if kind == 'quantity':
+        amount = value['amount'].lstrip('+')
+        unit = value['unit'].rsplit('/', 1)[-1] if value['unit'] != '1' else 'Q199'
+        return amount, amount, unit
+    if kind == 'time':
+        # '+1758-00-00T00:00:00Z' becomes '1758-01-01T00:00:00Z'
+        time_value = value['time'].lstrip('+')
+        date, clock = time_value.split('T')
+        parts = date.rsplit('-', 2)
+        parts = [parts[0]] + [part if part != '00' else '01' for part in parts[1:]]
+        return '-'.join(parts) + 'T' + clock, None, None
+    if kind == 'monolingualtext':
+        return value['text'], None, None
+    if kind == 'globecoordinate':
+        return 'Point(' + str(value['longitude']) + ' ' + str(value['latitude']) + ')', None, None
+    return str(value), None, None
+
+'''Returns the IDs an entity refers to in its statements and qualifiers'''
+def referencedIDs(entity):
+    IDs = set()
+    for claims in entity.get('claims', {}).values():
+        for claim in claims:
+            snaks = [claim['mainsnak']]
+            for qualifiers in claim.get('qualifiers', {}).values():
+                snaks.extend(qualifiers)
+            for snak in snaks:
+                value, amount, unit = snakValue(snak)
+                if snak.get('datavalue', {}).get('type') == 'wikibase-entityid':
+                    IDs.add(value)
+                if unit is not None:
+                    IDs.add(unit)
+    return IDs
+
+'''Writes the labels and aliases of an entity, for the given languages (None for all)'''
+def storeLabels(db, entity, languages=None):
+    rows = []
+    for lang, label in entity.get('labels', {}).items():
+        if languages is None or lang in languages:
+            rows.append((entity['id'], lang, label['value'], label['value'].lower(), 0))
+    for lang, aliases in entity.get('aliases', {}).items():
+        if languages is None or lang in languages:
+            for alias in aliases:
+                rows.append((entity['id'], lang, alias['value'], alias['value'].lower(), 1))
+    db.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?)', rows)
+
+'''Writes the statements and qualifiers of an entity'''
+def storeStatements(db, entity):
+    for prop, claims in entity.get('claims', {}).items():
+        for claim in claims:
+            value, amount, unit = snakValue(claim['mainsnak'])
+            if value is None:
+                continue
+            db.execute('INSERT INTO statements VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (claim['id'], entity['id'], prop, claim.get('rank', 'normal'), value, amount, unit))
+            for qprop, qualifiers in claim.get('qualifiers', {}).items():
+                for qualifier in qualifiers:
+                    qvalue = snakValue(qualifier)[0]
+                    if qvalue is not None:
+                        db.execute('INSERT INTO qualifiers VALUES (?, ?, ?)', (claim['id'], qprop, qvalue))
+
+'''Builds the store from a Wikidata JSON dump. The first pass keeps the taxa and animals
+with labels in all languages and all statements, the second pass adds the Dutch and
+English labels of the properties and of the items these statements refer to.'''
+def build(dump_path, store_path, languages=('nl', 'en')):
+    db = sqlite3.connect(store_path)
+    db.executescript(SCHEMA)
+
+    referenced = set()
+    kept = set()
+    for n, entity in enumerate(readDump(dump_path)):
+        if entity.get('type') == 'item' and isAnimalEntity(entity):
+            kept.add(entity['id'])
+            storeLabels(db, entity)
+            for lang, description in entity.get('descriptions', {}).items():
+                if lang in languages:
+                    db.execute('INSERT INTO descriptions VALUES (?, ?, ?)', (entity['id'], lang, description['value']))
+            storeStatements(db, entity)
+            referenced.update(referencedIDs(entity))
+        if n % 100000 == 0:
+            db.commit()
+            print('\rpass 1: ' + str(n) + ' entities, ' + str(len(kept)) + ' kept', end='', file=sys.stderr, flush=True)
+    db.commit()
+    print(file=sys.stderr)
+
+    referenced -= kept
+    for n, entity in enumerate(readDump(dump_path)):
+        if entity['id'] in referenced or entity.get('type') == 'property':
+            storeLabels(db, entity, languages)
+        if n % 100000 == 0:
+            db.commit()
+            print('\rpass 2: ' + str(n) + ' entities', end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+    db.executescript(INDEXES)
+    db.commit()
+    db.close()
+
+'''Read-only access to a store made by build(), answering the same kinds of lookups
+as the wbsearchentities and SPARQL requests of VAsysteem'''
+class KnowledgeStore:
+    def __init__(self, path):
+        self.db = sqlite3.connect('file:' + path + '?mode=ro', uri=True, check_same_thread=False)
+
+    '''Returns the IDs whose label or alias matches the search text, like wbsearchentities'''
+    def search(self, text, lang='nl', p=False):
+        kind = 'P%' if p else 'Q%'
+        norm = text.lower()
+        IDs = []
+        # Exact matches first (labels before aliases, the search language before English), then prefixes.
+        # The prefix is a range on norm, so both lookups use the labels_norm index.
+        for condition, values in [('norm = ?', (norm,)), ('norm >= ? AND norm < ?', (norm, norm + '\uffff'))]:
+            rows = self.db.execute('SELECT id FROM labels WHERE ' + condition + ' AND id LIKE ? '
+                                   'ORDER BY alias, lang != ?, lang != \'en\', rowid', values + (kind, lang))
+            for (ID,) in rows:
+                if ID not in IDs:
+                    IDs.append(ID)
+                if len(IDs) == SEARCH_LIMIT:
+                    return IDs
+        return IDs
+
+    '''Returns the label of an ID in the first language that has one, or the ID itself,
+    like the label service of the SPARQL endpoint'''
+    def label(self, ID, languages=('nl', 'en')):
+        for lang in languages:
+            row = self.db.execute('SELECT label FROM labels WHERE id = ? AND lang = ? AND alias = 0', (ID, lang)).fetchone()
+            if row is not None:
+                return row[0]
+        return ID
+
+    '''Returns how many signals say an ID is an animal (0, 1 or 2), see animalScores in VAsysteem'''
+    def animalScore(self, ID, words):
+        score = 0
+        for (code,) in self.db.execute('SELECT value FROM statements WHERE subject = ? AND property = \'P1417\'', (ID,)):
+            if code.startswith('animal'):
+                score += 1
+                break
+        row = self.db.execute('SELECT description FROM descriptions WHERE id = ? AND lang = \'nl\'', (ID,)).fetchone()
+        if row is not None and any(word in row[0].lower() for word in words):
+            score += 1
+        return score
+
+    '''Returns the statements of an item for a property, only the best rank when truthy (wdt:)'''
+    def statements(self, ID, prop, truthy=False):
+        rows = self.db.execute('SELECT statement, rank, value, amount, unit FROM statements '
+                               'WHERE subject = ? AND property = ? ORDER BY rowid', (ID, prop)).fetchall()
+        if truthy:
+            rows = [row for row in rows if row[1] != 'deprecated']
+            if any(row[1] == 'preferred' for row in rows):
+                rows = [row for row in rows if row[1] == 'preferred']
+        return rows
+
+    '''Returns a value as the label service would show it'''
+    def valueLabel(self, value):
+        if value[:1] in ['Q', 'P'] and value[1:].isdigit():
+            return self.label(value)
+        return value
+
+    '''wd:ID wdt:P ?ans'''
+    def values(self, ID, prop):
+        return [self.valueLabel(row[2]) for row in self.statements(ID, prop, truthy=True)]
+
+    '''wd:ID p:P ?x. ?x psv:P ?node, with the amount and the unit of the node'''
+    def quantities(self, ID, prop):
+        answers = []
+        for statement, rank, value, amount, unit in self.statements(ID, prop):
+            if amount is not None:
+                answers += [amount, self.label(unit)]
+        return answers
+
+    '''Statements of wd:ID for P that have the qualifier pq:qprop wd:qvalue'''
+    def qualified(self, ID, prop, qprop, qvalue, metric):
+        answers = []
+        for statement, rank, value, amount, unit in self.statements(ID, prop):
+            row = self.db.execute('SELECT 1 FROM qualifiers WHERE statement = ? AND property = ? AND value = ?',
+                                  (statement, qprop, qvalue)).fetchone()
+            if row is None or (metric and amount is None):
+                continue
+            answers.append(ENTITY_URI + 'statement/' + statement.replace('$', '-'))
+            answers.append(self.valueLabel(value))
+            if metric:
+                answers.append(self.label(unit))
+        return answers
+
+    '''The label of an ID in one language, or the ID itself'''
+    def labels(self, ID, lang):
+        return [self.label(ID, (lang,))]
+
+    '''ASK { wd:ID wdt:P wd:target }'''
+    def ask(self, ID, prop, target):
+        return any(row[2] == target for row in self.statements(ID, prop, truthy=True))
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print('usage: python knowledge_store.py build <wikidata dump (.json, .json.gz or .json.bz2)> <store.sqlite>')
+        sys.exit(1)
+    build(sys.argv[2], sys.argv[3])
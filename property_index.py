@@ -0,0 +1,121 @@
+import mmap
+import sqlite3
+import sys
+import time
+
+INDEX_VERSION = 1
+HEADER = 'VASYSTEEM-PROPERTIES'
+
+LABELS_QUERY = '''SELECT ?p ?label ?alias WHERE {
+  ?p a wikibase:Property .
+  { ?p rdfs:label ?label . BIND(0 AS ?alias) } UNION { ?p skos:altLabel ?label . BIND(1 AS ?alias) }
+  FILTER (lang(?label) = "nl" || lang(?label) = "en")
+}'''
+
+'''Normalizes a property label for lookup'''
+def normalize(label):
+    return ' '.join(label.lower().split())
+
+'''Returns (PID, lang, label, alias) rows from the Wikidata endpoint'''
+def labelsFromWikidata():
+    import requests
+    response = requests.get('https://query.wikidata.org/sparql',
+                            params={'query': LABELS_QUERY, 'format': 'json'},
+                            headers={'User-Agent': 'VAsysteem property index builder'})
+    response.raise_for_status()
+    rows = []
+    for item in response.json()['results']['bindings']:
+        rows.append((item['p']['value'].rsplit('/', 1)[-1], item['label']['xml:lang'],
+                     item['label']['value'], int(item['alias']['value'])))
+    return rows
+
+'''Returns (PID, lang, label, alias) rows from a knowledge store (see knowledge_store.py)'''
+def labelsFromStore(store_path):
+    db = sqlite3.connect('file:' + store_path + '?mode=ro', uri=True)
+    rows = db.execute('SELECT id, lang, label, alias FROM labels WHERE id LIKE \'P%\' AND lang IN (\'nl\', \'en\')').fetchall()
+    db.close()
+    return rows
+
+'''Builds the index file: every nl/en label and alias of a property maps to its PIDs
+(labels before aliases, Dutch before English), and every synonym of a categoryOf
+category maps to the PIDs of the category. Lines are sorted for binary search.'''
+def build(index_path, categories, store_path=None):
+    rows = labelsFromStore(store_path) if store_path is not None else labelsFromWikidata()
+    rows.sort(key=lambda row: (row[3], row[1] != 'nl', int(row[0][1:])))
+
+    index = {}
+    for PID, lang, label, alias in rows:
+        PIDs = index.setdefault(normalize(label), [])
+        if PID not in PIDs:
+            PIDs.append(PID)
+    for cat, synonyms in categories.items():
+        PIDs = index.get(normalize(cat), [])
+        for synonym in synonyms:
+            key = normalize(synonym)
+            if key not in index and PIDs:
+                index[key] = list(PIDs)
+
+    lines = [key + '\t' + ','.join(PIDs) for key, PIDs in index.items() if '\t' not in key and '\n' not in key]
+    # Sorted on the UTF-8 bytes, the order in which the mapped file is searched
+    lines.sort(key=lambda line: line.split('\t', 1)[0].encode('utf-8'))
+    with open(index_path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(HEADER + ' ' + str(INDEX_VERSION) + ' ' + time.strftime('%Y-%m-%d') + '\n')
+        for line in lines:
+            f.write(line + '\n')
+    return len(lines)
+
+'''Read-only, memory-mapped property label index made by build()'''
+class PropertyIndex:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self.data[:self.data.find(b'\n')].decode('utf-8').split()
+        if len(header) < 2 or header[0] != HEADER or int(header[1]) != INDEX_VERSION:
+            raise ValueError(path + ' is not a version ' + str(INDEX_VERSION) + ' property index')
+        self.version = int(header[1])
+        self.built = header[2] if len(header) > 2 else None
+        self.start = self.data.find(b'\n') + 1
+
+    '''Returns the line that starts at or before position'''
+    def lineAt(self, position):
+        begin = self.data.rfind(b'\n', self.start - 1, position) + 1
+        end = self.data.find(b'\n', begin)
+        return begin, end
+
+    '''Returns the PIDs of a property label, or [] when the label is unknown'''
+    def lookup(self, label):
+        key = normalize(label).encode('utf-8')
+        low = self.start
+        high = len(self.data)
+        # Binary search over byte positions, every probe is moved to the start of its line
+        while low < high:
+            middle = (low + high) // 2
+            begin, end = self.lineAt(middle)
+            line_key, PIDs = self.data[begin:end].split(b'\t', 1)
+            if line_key == key:
+                return PIDs.decode('utf-8').split(',')
+            if line_key < key:
+                low = end + 1
+            else:
+                high = begin
+        return []
+
+    '''Yields all labels in the index'''
+    def labels(self):
+        position = self.start
+        while position < len(self.data):
+            end = self.data.find(b'\n', position)
+            yield self.data[position:self.data.find(b'\t', position, end)].decode('utf-8')
+            position = end + 1
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [3, 4] or sys.argv[1] != 'build':
+        print('usage: python property_index.py build <properties.idx> [store.sqlite]')
+        sys.exit(1)
+    from VAsysteem import CAT_DICT
+    count = build(sys.argv[2], CAT_DICT, sys.argv[3] if len(sys.argv) == 4 else None)
+    print(str(count) + ' property labels')
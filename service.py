@@ -0,0 +1,188 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import VAsysteem
+
+BATCH_WINDOW = 0.01 # seconds a parse batch waits for more questions
+MAX_BATCH = 64 # questions per nlp.pipe call
+WORKERS = 8 # questions answered at the same time
+
+'''Collects the questions of concurrent requests and parses them together with nlp.pipe'''
+class ParseBatcher:
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.waiting = queue.Queue()
+        self.batches = 0
+        self.parsed = 0
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    '''Returns a future of the parsed question'''
+    def parse(self, question):
+        future = Future()
+        self.waiting.put((question, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.waiting.get()]
+            # Wait a little for more questions, unless the batch is full
+            ends = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = ends - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.waiting.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                parsed = VAsysteem.parseQuestions([question for question, future in batch], n_process=1)
+                for (question, future), parse in zip(batch, parsed):
+                    future.set_result(parse)
+            except Exception as e:
+                for question, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.parsed += len(batch)
+
+'''Answers questions with a warm model and caches. Identical questions that are
+answered at the same time share one computation.'''
+class AnsweringService:
+    def __init__(self, workers=WORKERS, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.started = time.time()
+        VAsysteem.warmup()
+        self.batcher = ParseBatcher(window, max_batch)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.questions = 0
+        self.coalesced = 0
+        self.reasons = {}
+
+    '''Returns a future of (answer, reason) for a question'''
+    def answer(self, question):
+        with self.lock:
+            self.questions += 1
+            if question in self.in_flight:
+                self.coalesced += 1
+                return self.in_flight[question]
+            future = self.pool.submit(self.compute, question)
+            self.in_flight[question] = future
+        future.add_done_callback(lambda done: self.finished(question))
+        return future
+
+    def compute(self, question):
+        parse = self.batcher.parse(question).result()
+        answer, reason = VAsysteem.answerQuestionDetailed(parse)
+        with self.lock:
+            kind = reason.split(':')[0]
+            self.reasons[kind] = self.reasons.get(kind, 0) + 1
+        return answer, reason
+
+    def finished(self, question):
+        with self.lock:
+            self.in_flight.pop(question, None)
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'model': VAsysteem.SPACY_MODEL,
+            'uptime': time.time() - self.started
+        }
+
+    def metrics(self):
+        with self.lock:
+            metrics = {
+                'questions': self.questions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.in_flight),
+                'reasons': dict(self.reasons)
+            }
+        metrics['parse_batches'] = self.batcher.batches
+        metrics['mean_parse_batch'] = self.batcher.parsed / self.batcher.batches if self.batcher.batches else 0.0
+        # Stage histograms, requests per host, cache hit rates, question types and errors
+        metrics['pipeline'] = VAsysteem.metricsReport()
+        return metrics
+
+'''HTTP interface: POST /answer with {"question": ...} or {"questions": [...]},
+GET /health and GET /metrics'''
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send(200, self.service.health())
+        elif self.path == '/metrics':
+            self.send(200, self.service.metrics())
+        else:
+            self.send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/answer':
+            self.send(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            self.send(400, {'error': 'body is not valid JSON'})
+            return
+
+        # A failed parse or answer is a server error, not a dropped connection
+        try:
+            if isinstance(body, dict) and isinstance(body.get('question'), str):
+                answer, reason = self.service.answer(body['question']).result()
+                self.send(200, {'question': body['question'], 'answer': answer, 'reason': reason})
+            elif isinstance(body, dict) and isinstance(body.get('questions'), list):
+                questions = [str(question) for question in body['questions']]
+                futures = [self.service.answer(question) for question in questions]
+                answers = []
+                for question, future in zip(questions, futures):
+                    answer, reason = future.result()
+                    answers.append({'question': question, 'answer': answer, 'reason': reason})
+                self.send(200, {'answers': answers})
+            else:
+                self.send(400, {'error': 'expected {"question": ...} or {"questions": [...]}'})
+        except Exception as e:
+            self.send(500, {'error': type(e).__name__ + ': ' + str(e)})
+
+    # Requests are counted in /metrics instead of logged
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Answering service with a warm model and caches')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='questions answered at the same time')
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW, help='seconds a parse batch waits for more questions')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='questions per parse batch')
+    args = parser.parse_args()
+
+    RequestHandler.service = AnsweringService(args.workers, args.batch_window, args.max_batch)
+    server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    print('Listening on http://' + args.host + ':' + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import alias_index
+import property_index
+import VAsysteem
+
+class PropertyIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        store = os.path.join(self.dir.name, 'store.sqlite')
+        db = sqlite3.connect(store)
+        db.execute('CREATE TABLE labels (id TEXT, lang TEXT, label TEXT, norm TEXT, alias INTEGER)')
+        db.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?)', [
+            ('P462', 'nl', 'kleur', 'kleur', 0),
+            ('P462', 'en', 'color', 'color', 0),
+            ('P2067', 'nl', 'massa', 'massa', 0),
+            ('P2067', 'nl', 'gewicht', 'gewicht', 1),
+            ('P1', 'nl', 'gewicht', 'gewicht', 0),
+            ('Q140', 'nl', 'leeuw', 'leeuw', 0)
+        ])
+        db.commit()
+        db.close()
+        self.path = os.path.join(self.dir.name, 'properties.idx')
+        property_index.build(self.path, {'kleur': ['kleuren', 'tint']}, store)
+        self.index = property_index.PropertyIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_lookup_labels_and_aliases(self):
+        self.assertEqual(self.index.lookup('kleur'), ['P462'])
+        self.assertEqual(self.index.lookup('  Color '), ['P462'])
+        # Labels come before aliases
+        self.assertEqual(self.index.lookup('gewicht'), ['P1', 'P2067'])
+
+    def test_lookup_synonyms(self):
+        self.assertEqual(self.index.lookup('tint'), ['P462'])
+        self.assertEqual(self.index.lookup('kleuren'), ['P462'])
+
+    def test_lookup_unknown(self):
+        self.assertEqual(self.index.lookup('leeuw'), [])
+        self.assertEqual(self.index.lookup('aaa'), [])
+        self.assertEqual(self.index.lookup('zzz'), [])
+
+    def test_labels_sorted(self):
+        labels = list(self.index.labels())
+        self.assertEqual(labels, sorted(labels, key=lambda label: label.encode('utf-8')))
+        self.assertIn('massa', labels)
+
+class AliasIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        store = os.path.join(self.dir.name, 'store.sqlite')
+        db = sqlite3.connect(store)
+        db.execute('CREATE TABLE labels (id TEXT, lang TEXT, label TEXT, norm TEXT, alias INTEGER)')
+        db.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?)', [
+            ('Q146', 'nl', 'kat', 'kat', 0),
+            ('Q146', 'en', 'cat', 'cat', 0),
+            ('Q7378', 'nl', 'olifant', 'olifant', 0),
+            ('Q36101', 'nl', 'koala', 'koala', 0),
+            ('Q18498', 'nl', 'wolf', 'wolf', 0),
+            ('Q1366', 'nl', 'kalf', 'kalf', 0),
+            ('Q41050', 'nl', 'Orang-oetang', 'orang-oetang', 0),
+            ('Q41050', 'nl', 'orang oetan', 'orang oetan', 1),
+            ('Q3', 'nl', 'koala', 'koala', 1),
+            ('Q140', 'de', 'Löwe', 'löwe', 0),
+            ('P462', 'nl', 'kleur', 'kleur', 0)
+        ])
+        db.commit()
+        db.close()
+        self.path = os.path.join(self.dir.name, 'aliases.idx')
+        self.count = alias_index.build(store, self.path)
+        self.index = alias_index.load(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_build(self):
+        # Only Dutch and English labels of items
+        self.assertEqual(self.count, 8)
+        self.assertEqual(self.index.exact('kleur'), [])
+        self.assertEqual(self.index.exact('lowe'), [])
+        # Labels before aliases
+        self.assertEqual(self.index.exact('koala'), ['Q36101', 'Q3'])
+        self.assertEqual(self.index.exact('orang oetan'), ['Q41050'])
+
+    def test_exact_missing(self):
+        self.assertEqual(self.index.exact('aaa'), [])
+        self.assertEqual(self.index.exact('ka'), [])
+        self.assertEqual(self.index.exact('zzz'), [])
+
+    def test_exact(self):
+        self.assertEqual(self.index.lookup('Olifant'), [('Q7378', alias_index.EXACT_SCORE)])
+        self.assertEqual(self.index.lookup('Cat'), [('Q146', alias_index.EXACT_SCORE)])
+        self.assertEqual(self.index.lookup('orang oetang'), [('Q41050', alias_index.EXACT_SCORE)])
+
+    def test_plurals(self):
+        self.assertEqual(self.index.lookup('katten'), [('Q146', alias_index.LEMMA_SCORE)])
+        self.assertEqual(self.index.lookup('wolven'), [('Q18498', alias_index.LEMMA_SCORE)])
+        self.assertEqual(self.index.lookup('kalveren'), [('Q1366', alias_index.LEMMA_SCORE)])
+        self.assertEqual(self.index.lookup("koala's")[0][0], 'Q36101')
+
+    def test_fuzzy(self):
+        ID, score = self.index.lookup('olifnt')[0]
+        self.assertEqual(ID, 'Q7378')
+        self.assertLess(score, alias_index.LEMMA_SCORE)
+        self.assertEqual(self.index.lookup('orang oetanng')[0][0], 'Q41050')
+        self.assertEqual(list(self.index.fuzzy('koalaa', 1)), [(['Q36101', 'Q3'], 1)])
+
+    def test_short_words_are_not_fuzzy(self):
+        self.assertEqual(self.index.lookup('kot'), [])
+
+    def test_lemmatizer(self):
+        self.assertEqual(self.index.lookup('poes', lemmatizer=lambda text: 'olifant'), [('Q7378', alias_index.LEMMA_SCORE)])
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = VAsysteem.LRUCache(max_size=2)
+        cache.put(('a',), 1)
+        cache.put(('b',), 2)
+        self.assertEqual(cache.get(('a',)), 1)
+        cache.put(('c',), 3)
+        self.assertIsNone(cache.get(('b',)))
+        self.assertEqual(cache.get(('a',)), 1)
+        self.assertEqual(cache.get(('c',)), 3)
+
+    def test_expiry(self):
+        cache = VAsysteem.LRUCache(ttl=60)
+        cache.put(('a',), 1)
+        cache.entries[('a',)] = (1, time.time() - 120)
+        self.assertIsNone(cache.get(('a',)))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.json')
+            cache = VAsysteem.LRUCache(path)
+            cache.put(('kat', 'nl', 'item'), ['Q146'])
+            cache.save()
+            loaded = VAsysteem.LRUCache(path)
+            self.assertEqual(loaded.get(('kat', 'nl', 'item')), ['Q146'])
+
+    def test_save_without_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.json')
+            cache = VAsysteem.LRUCache(path)
+            cache.get(('kat', 'nl', 'item'))
+            cache.save()
+            self.assertFalse(os.path.exists(path))
+
+class SparqlCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'sparql.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_evicts_least_recently_used(self):
+        cache = VAsysteem.SparqlCache(self.path, max_size=2)
+        cache.put('SELECT ?a', {'boolean': True})
+        time.sleep(0.01)
+        cache.put('SELECT ?b', {'boolean': False})
+        time.sleep(0.01)
+        # A hit makes the result recently used, also before its use time is written
+        self.assertEqual(cache.get('SELECT  ?a'), {'boolean': True})
+        time.sleep(0.01)
+        cache.put('SELECT ?c', {'boolean': True})
+        self.assertIsNone(cache.get('SELECT ?b'))
+        self.assertEqual(cache.get('SELECT ?a'), {'boolean': True})
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_opened_on_first_use(self):
+        cache = VAsysteem.SparqlCache(self.path)
+        cache.flush()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(cache.get('SELECT ?a'))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_read_only(self):
+        cache = VAsysteem.SparqlCache(self.path)
+        cache.put('SELECT ?a', {'boolean': True})
+        cache.flush()
+        read_only = VAsysteem.SparqlCache(self.path, read_only=True)
+        read_only.put('SELECT ?b', {'boolean': True})
+        self.assertEqual(read_only.get('SELECT ?a'), {'boolean': True})
+        self.assertIsNone(read_only.get('SELECT ?b'))
+
+class PlanAnswersTest(unittest.TestCase):
+    def setUp(self):
+        self.getResult = VAsysteem.getResult
+
+    def tearDown(self):
+        VAsysteem.getResult = self.getResult
+
+    def test_values_are_split_per_combination(self):
+        entity = 'http://www.wikidata.org/entity/'
+        VAsysteem.getResult = lambda query: {'vars': ['item', 'prop', 'ansLabel'], 'rows': [
+            [entity + 'Q1', entity + 'P462', 'bruin'],
+            [entity + 'Q1', entity + 'P462', 'zwart'],
+            [entity + 'Q2', entity + 'P462', 'grijs']
+        ]}
+        pairs = [('Q1', 'P462'), ('Q1', 'P2067'), ('Q2', 'P462')]
+        self.assertEqual(VAsysteem.planAnswers('query', ['item', 'prop'], pairs), [['bruin', 'zwart'], [], ['grijs']])
+
+    def test_boolean_combinations(self):
+        entity = 'http://www.wikidata.org/entity/'
+        VAsysteem.getResult = lambda query: {'vars': ['item', 'target', 'prop'], 'rows': [
+            [entity + 'Q1', entity + 'Q5', entity + 'P171']
+        ]}
+        pairs = [('Q1', 'Q5', 'P171'), ('Q1', 'Q6', 'P171')]
+        self.assertEqual(VAsysteem.planAnswers('query', ['item', 'target', 'prop'], pairs), [True, False])
+
+    def test_no_query(self):
+        self.assertEqual(VAsysteem.planAnswers(None, [], []), [])
+
+if __name__ == '__main__':
+    unittest.main()
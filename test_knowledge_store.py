@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import knowledge_store
+
+class KnowledgeStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, 'store.sqlite')
+        db = sqlite3.connect(path)
+        db.executescript(knowledge_store.SCHEMA)
+        db.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?)', [
+            ('Q1', 'nl', 'katachtige', 'katachtige', 0),
+            ('Q146', 'en', 'cat', 'cat', 0),
+            ('Q3', 'nl', 'kat', 'kat', 1),
+            ('Q146', 'nl', 'kat', 'kat', 0),
+            ('Q4', 'en', 'kat', 'kat', 0),
+            ('Q5', 'nl', 'katvis', 'katvis', 0),
+            ('P462', 'nl', 'kleur', 'kleur', 0),
+            ('Q6', 'nl', 'kleurrijke vogel', 'kleurrijke vogel', 0)
+        ])
+        db.executemany('INSERT INTO statements VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            ('Q146$1', 'Q146', 'P462', 'normal', 'Q7', None, None),
+            ('Q146$2', 'Q146', 'P462', 'preferred', 'Q8', None, None),
+            ('Q146$3', 'Q146', 'P462', 'deprecated', 'Q9', None, None),
+            ('Q146$4', 'Q146', 'P2067', 'normal', '4', '4', 'Q11570'),
+            ('Q140$1', 'Q140', 'P462', 'normal', 'Q7', None, None),
+            ('Q140$2', 'Q140', 'P462', 'deprecated', 'Q8', None, None)
+        ])
+        db.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?)', [
+            ('Q7', 'nl', 'zwart', 'zwart', 0),
+            ('Q8', 'en', 'grey', 'grey', 0),
+            ('Q11570', 'nl', 'kilogram', 'kilogram', 0)
+        ])
+        db.executescript(knowledge_store.INDEXES)
+        db.commit()
+        db.close()
+        self.store = knowledge_store.KnowledgeStore(path)
+
+    def tearDown(self):
+        self.store.db.close()
+        self.dir.cleanup()
+
+    def test_search_exact_before_prefix(self):
+        # Labels before aliases, the search language before English, then the prefix matches
+        self.assertEqual(self.store.search('Kat'), ['Q146', 'Q4', 'Q3', 'Q1', 'Q5'])
+        self.assertEqual(self.store.search('kat', lang='en'), ['Q4', 'Q146', 'Q3', 'Q1', 'Q5'])
+
+    def test_search_kind(self):
+        self.assertEqual(self.store.search('kleur', p=True), ['P462'])
+        self.assertEqual(self.store.search('kleur'), ['Q6'])
+        self.assertEqual(self.store.search('hond'), [])
+
+    def test_search_limit(self):
+        saved = knowledge_store.SEARCH_LIMIT
+        knowledge_store.SEARCH_LIMIT = 2
+        try:
+            self.assertEqual(self.store.search('kat'), ['Q146', 'Q4'])
+        finally:
+            knowledge_store.SEARCH_LIMIT = saved
+
+    def test_rank(self):
+        # Truthy values are the preferred ones when there are any, never the deprecated ones
+        self.assertEqual(self.store.values('Q146', 'P462'), ['grey'])
+        self.assertEqual(self.store.values('Q140', 'P462'), ['zwart'])
+        self.assertEqual(len(self.store.statements('Q146', 'P462')), 3)
+
+    def test_quantities(self):
+        self.assertEqual(self.store.quantities('Q146', 'P2067'), ['4', 'kilogram'])
+        self.assertEqual(self.store.label('Q404'), 'Q404')
+
+class SnakValueTest(unittest.TestCase):
+    def snak(self, kind, value):
+        return {'datavalue': {'type': kind, 'value': value}}
+
+    def test_time(self):
+        self.assertEqual(knowledge_store.snakValue(self.snak('time', {'time': '+1758-00-00T00:00:00Z'})),
+                         ('1758-01-01T00:00:00Z', None, None))
+        self.assertEqual(knowledge_store.snakValue(self.snak('time', {'time': '+2001-05-00T00:00:00Z'})),
+                         ('2001-05-01T00:00:00Z', None, None))
+        # Years before the common era keep their sign
+        self.assertEqual(knowledge_store.snakValue(self.snak('time', {'time': '-66000000-00-00T00:00:00Z'})),
+                         ('-66000000-01-01T00:00:00Z', None, None))
+
+    def test_quantity(self):
+        value = {'amount': '+4.5', 'unit': 'http://www.wikidata.org/entity/Q11570'}
+        self.assertEqual(knowledge_store.snakValue(self.snak('quantity', value)), ('4.5', '4.5', 'Q11570'))
+        self.assertEqual(knowledge_store.snakValue(self.snak('quantity', {'amount': '+3', 'unit': '1'})), ('3', '3', 'Q199'))
+
+    def test_no_value(self):
+        self.assertEqual(knowledge_store.snakValue({'snaktype': 'novalue'}), (None, None, None))
+
+if __name__ == '__main__':
+    unittest.main()
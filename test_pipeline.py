@@ -0,0 +1,244 @@
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import VAsysteem
+
+'''Parse with the parts of ParsedQuestion that routeQuestion uses'''
+class FakeParse:
+    class Token:
+        def __init__(self, text):
+            self.text = text
+            self.lemma_ = text.lower()
+
+    def __init__(self, text, pos='NOUN', lemma=None):
+        self.text = text
+        self.tokens = [self.Token(word) for word in text.rstrip('?').split()]
+        if lemma is not None:
+            self.tokens[0].lemma_ = lemma
+        self.first_pos = pos
+
+    def __getitem__(self, n):
+        return self.tokens[n]
+
+    def pos(self, word):
+        return self.first_pos
+
+class RouterTest(unittest.TestCase):
+    def route(self, text, pos='NOUN', lemma=None):
+        return VAsysteem.routeQuestion(FakeParse(text, pos, lemma)).name
+
+    def test_question_types(self):
+        self.assertEqual(self.route('Welke kleur heeft een leeuw?', lemma='welk'), 'welk')
+        self.assertEqual(self.route('Hoe groot kan een walvis worden?'), 'maximale grootte')
+        self.assertEqual(self.route('Hoe oud is de oudste kat geworden?'), 'oudste')
+        self.assertEqual(self.route('Hoe zwaar is een olifant?'), 'hoe zwaar')
+        self.assertEqual(self.route('Hoe snel is een jachtluipaard?'), 'hoe')
+        self.assertEqual(self.route('Is een walvis een vis?', pos='AUX'), 'ja/nee')
+        self.assertEqual(self.route('Eet een panda bamboe?', pos='VERB'), 'eet')
+        self.assertEqual(self.route('Hoeveel weegt een kat?'), 'hoeveel weegt')
+        self.assertEqual(self.route('Wat is de wetenschappelijke naam van een kat?'), 'naam van')
+        self.assertEqual(self.route('Wat eet een koala?'), 'rest')
+
+    def test_first_matching_type_wins(self):
+        def handler(parse, sent_cl):
+            return None
+        router = VAsysteem.compileRouter([
+            VAsysteem.QuestionType('a', handler, 'Hoe.*'),
+            VAsysteem.QuestionType('b', handler, 'Hoe groot.*'),
+            VAsysteem.QuestionType('test', handler, test=lambda parse: parse.text.endswith('!')),
+            VAsysteem.QuestionType('c', handler, 'Wat.*')
+        ])
+        # The regex types on either side of a test type are separate stages
+        self.assertEqual([[qtype.name for qtype in qtypes] for pattern, qtypes in router], [['a', 'b'], ['test'], ['c']])
+        saved = VAsysteem.question_router, VAsysteem.question_type_hits
+        VAsysteem.question_router = router
+        VAsysteem.question_type_hits = {'a': 0, 'b': 0, 'test': 0, 'c': 0}
+        try:
+            self.assertEqual(VAsysteem.routeQuestion(FakeParse('Hoe groot is een kat?')).name, 'a')
+            self.assertEqual(VAsysteem.routeQuestion(FakeParse('Wat is dat!')).name, 'test')
+            self.assertEqual(VAsysteem.routeQuestion(FakeParse('Wat is dat?')).name, 'c')
+            self.assertIsNone(VAsysteem.routeQuestion(FakeParse('Waar woont een kat?')))
+            self.assertEqual(VAsysteem.question_type_hits, {'a': 1, 'b': 0, 'test': 1, 'c': 1})
+        finally:
+            VAsysteem.question_router, VAsysteem.question_type_hits = saved
+
+class DeadlineTest(unittest.TestCase):
+    def test_stage_shares(self):
+        deadline = VAsysteem.Deadline(10.0)
+        shares = 0.0
+        for stage, fraction in VAsysteem.STAGE_BUDGETS.items():
+            shares += fraction
+            self.assertAlmostEqual(deadline.remaining(stage), 10.0 * shares, delta=0.05)
+        self.assertAlmostEqual(deadline.left(), 10.0, delta=0.05)
+
+    def test_check(self):
+        deadline = VAsysteem.Deadline(0.01)
+        time.sleep(0.02)
+        with self.assertRaises(VAsysteem.DeadlineExceeded) as raised:
+            deadline.check('search')
+        self.assertEqual(raised.exception.stage, 'search')
+        self.assertEqual(deadline.left(), 0.0)
+
+    def test_no_budget(self):
+        deadline = VAsysteem.Deadline(None)
+        self.assertIsNone(deadline.remaining('values'))
+        self.assertIsNone(deadline.left())
+        deadline.check('values')
+
+class WaitStageTest(unittest.TestCase):
+    def test_results_in_order(self):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(lambda n: n * 2, n) for n in range(3)]
+            self.assertEqual(VAsysteem.waitStage(futures, VAsysteem.Deadline(10.0), 'search'), [0, 2, 4])
+
+    def test_deadline_cancels_waiting_futures(self):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            futures = [pool.submit(time.sleep, 0.2), pool.submit(time.sleep, 0.2)]
+            with self.assertRaises(VAsysteem.DeadlineExceeded) as raised:
+                VAsysteem.waitStage(futures, VAsysteem.Deadline(0.1), 'values')
+            self.assertEqual(raised.exception.stage, 'values')
+            self.assertTrue(futures[1].cancelled())
+
+class AnswerKeyTest(unittest.TestCase):
+    def test_normalized(self):
+        key = VAsysteem.answerKey({'Q': ['Afrikaanse  olifant'], 'P': 'massa'}, {'metricUnit': True}, [], ['massa'])
+        same = VAsysteem.answerKey({'Q': ['afrikaanse olifant '], 'P': 'massa'}, {'metricUnit': True}, [], [' Massa'])
+        self.assertEqual(key, same)
+        self.assertNotEqual(key, VAsysteem.answerKey({'Q': ['olifant'], 'P': 'massa'}, {'metricUnit': True}, [], ['massa']))
+        self.assertNotEqual(key, VAsysteem.answerKey({'Q': ['afrikaanse olifant'], 'P': 'massa'}, {'metricUnit': False}, [], ['massa']))
+
+    def test_entity_linker(self):
+        saved = VAsysteem.ENTITY_LINKER
+        key = VAsysteem.answerKey({'Q': ['kat'], 'P': 'kleur'}, {}, [], ['kleur'])
+        try:
+            VAsysteem.ENTITY_LINKER = 'local'
+            self.assertNotEqual(key, VAsysteem.answerKey({'Q': ['kat'], 'P': 'kleur'}, {}, [], ['kleur']))
+        finally:
+            VAsysteem.ENTITY_LINKER = saved
+
+'''Parse whose keys are already resolved, so resolveKeys does not need the model'''
+class ResolvedParse:
+    def __init__(self, Q, P, extra=None):
+        self.text = ' '.join(Q) + ' ' + P
+        self.resolved = ({'Q': Q, 'P': P}, extra if extra is not None else {'metricUnit': False}, [], [P])
+
+class PlanBatchTest(unittest.TestCase):
+    PATCHED = ['getIDs', 'getResult', 'animalIDs', 'animalScoresBulk', 'batch_results']
+    IDS = {'kat': ['Q146'], 'leeuw': ['Q140'], 'kleur': ['P462']}
+
+    def setUp(self):
+        self.saved = {name: getattr(VAsysteem, name) for name in self.PATCHED}
+        self.queries = []
+
+        def getIDs(query, p=False, lang='nl'):
+            if query not in self.IDS:
+                raise VAsysteem.WikidataError('HTTP 500 for ' + query)
+            return self.IDS[query]
+
+        def getResult(query):
+            self.queries.append(query)
+            entity = 'http://www.wikidata.org/entity/'
+            return {'vars': ['item', 'prop', 'ansLabel'], 'rows': [
+                [entity + 'Q146', entity + 'P462', 'grijs'],
+                [entity + 'Q140', entity + 'P462', 'geelbruin']
+            ]}
+
+        VAsysteem.getIDs = getIDs
+        VAsysteem.getResult = getResult
+        VAsysteem.animalIDs = lambda IDs: IDs
+        VAsysteem.animalScoresBulk = lambda IDs: None
+        VAsysteem.batch_results = VAsysteem.LRUCache(max_size=100)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(VAsysteem, name, value)
+
+    def errors(self):
+        return VAsysteem.pipeline_stats.errors.get('batch: WikidataError', 0)
+
+    def test_one_query_for_questions_of_one_kind(self):
+        VAsysteem.planBatch([ResolvedParse(['kat'], 'kleur'), ResolvedParse(['leeuw'], 'kleur')])
+        self.assertEqual(len(self.queries), 1)
+        variant = ('values', False)
+        self.assertEqual(VAsysteem.batchAnswers(variant, [('Q146', 'P462')]), [['grijs']])
+        self.assertEqual(VAsysteem.batchAnswers(variant, [('Q146', 'P462'), ('Q140', 'P462')]), [['grijs'], ['geelbruin']])
+        # A combination the planner did not resolve leaves the question to answerQuestion
+        self.assertIsNone(VAsysteem.batchAnswers(variant, [('Q146', 'P462'), ('Q1', 'P462')]))
+
+    def test_failed_search_is_recorded(self):
+        errors = self.errors()
+        VAsysteem.planBatch([ResolvedParse(['hond'], 'kleur'), ResolvedParse(['kat'], 'kleur')])
+        # The search in the batch and the one of searchIDs
+        self.assertEqual(self.errors(), errors + 2)
+        self.assertEqual(VAsysteem.batchAnswers(('values', False), [('Q146', 'P462')]), [['grijs']])
+
+class StreamJSONListTest(unittest.TestCase):
+    def setUp(self):
+        self.chunk_size = VAsysteem.READ_CHUNK_SIZE
+        # Items are split over several reads
+        VAsysteem.READ_CHUNK_SIZE = 4
+
+    def tearDown(self):
+        VAsysteem.READ_CHUNK_SIZE = self.chunk_size
+
+    def test_items(self):
+        items = [{'id': 1, 'question': 'Hoe zwaar is een olifant?'}, {'id': 2, 'question': '[,]'}, []]
+        stream = io.StringIO('  ' + json.dumps(items, indent=2))
+        self.assertEqual(list(VAsysteem.streamJSONList(stream)), items)
+        self.assertEqual(list(VAsysteem.streamJSONList(io.StringIO('[]'))), [])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            list(VAsysteem.streamJSONList(io.StringIO('{"id": 1}')))
+        with self.assertRaises(ValueError):
+            list(VAsysteem.streamJSONList(io.StringIO('[{"id": 1}, {"id": 2}')))
+
+class RunEvaluationTest(unittest.TestCase):
+    PATCHED = ['warmup', 'parseQuestions', 'answerQuestion', 'search_cache', 'sparql_cache', 'answer_cache']
+
+    def setUp(self):
+        self.saved = {name: getattr(VAsysteem, name) for name in self.PATCHED}
+        self.dir = tempfile.TemporaryDirectory()
+        self.answered = []
+
+        def answerQuestion(parse):
+            self.answered.append(parse)
+            return 'antwoord ' + parse
+
+        VAsysteem.warmup = lambda: None
+        VAsysteem.parseQuestions = lambda questions, batch_size=None, n_process=None: list(questions)
+        VAsysteem.answerQuestion = answerQuestion
+        VAsysteem.search_cache = VAsysteem.LRUCache()
+        VAsysteem.sparql_cache = VAsysteem.SparqlCache(':memory:')
+        VAsysteem.answer_cache = VAsysteem.LRUCache()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(VAsysteem, name, value)
+        self.dir.cleanup()
+
+    def test_resume_from_checkpoint(self):
+        in_path = os.path.join(self.dir.name, 'questions.jsonl')
+        out_path = os.path.join(self.dir.name, 'system.json')
+        with open(in_path, 'w', encoding='utf-8') as f:
+            for n, question in enumerate(['een', 'twee', 'drie']):
+                f.write(json.dumps({'id': n + 1, 'question': question}) + '\n')
+        # The first question was answered before the interruption, the second was cut off
+        with open(out_path + '.partial', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'id': 1, 'question': 'een', 'answer': 'eerder', 'correct': 1}) + '\n')
+            f.write('{"id": 2, "quest')
+
+        output = VAsysteem.runEvaluation(in_path, out_path, workers=2, checkpoint_every=1)
+        self.assertEqual(self.answered, ['twee', 'drie'])
+        self.assertEqual([record['answer'] for record in output], ['eerder', 'antwoord twee', 'antwoord drie'])
+        with open(out_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), output)
+        self.assertFalse(os.path.exists(out_path + '.partial'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import types
+import unittest
+from email.utils import formatdate
+
+import benchmark
+import VAsysteem
+
+'''Response with the parts of requests.Response that request() uses'''
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(body if body is not None else {}).encode('utf-8')
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+'''Stand-in for session.get that gives the responses in order and counts the calls'''
+class FakeGet:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url, params=None, timeout=None):
+        with self.lock:
+            self.calls.append(params)
+            response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if callable(response):
+            return response()
+        return response
+
+'''Replaces the session and the request settings of VAsysteem, and puts them back after the test'''
+class RequestTestCase(unittest.TestCase):
+    SETTINGS = ['session', 'HEDGE_AFTER', 'REQUESTS_PER_SECOND', 'DEFAULT_REQUESTS_PER_SECOND',
+                'MAX_RETRIES', 'BACKOFF_BASE']
+
+    def setUp(self):
+        self.saved = {name: getattr(VAsysteem, name) for name in self.SETTINGS}
+        VAsysteem.session = types.SimpleNamespace(get=None)
+        VAsysteem.HEDGE_AFTER = {}
+        VAsysteem.REQUESTS_PER_SECOND = {}
+        VAsysteem.DEFAULT_REQUESTS_PER_SECOND = 1000.0
+        VAsysteem.BACKOFF_BASE = 0.0
+        VAsysteem.host_limiters.clear()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(VAsysteem, name, value)
+        VAsysteem.host_limiters.clear()
+
+class TokenBucketTest(unittest.TestCase):
+    def test_capacity_and_refill(self):
+        bucket = VAsysteem.TokenBucket(10, capacity=2)
+        self.assertTrue(bucket.tryAcquire())
+        self.assertTrue(bucket.tryAcquire())
+        self.assertFalse(bucket.tryAcquire())
+        time.sleep(0.15)
+        self.assertTrue(bucket.tryAcquire())
+
+    def test_pause(self):
+        bucket = VAsysteem.TokenBucket(1000)
+        bucket.pause(0.1)
+        self.assertFalse(bucket.tryAcquire())
+        started = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+class HostLimiterTest(unittest.TestCase):
+    def test_throttled_halves_the_limit(self):
+        limiter = VAsysteem.HostLimiter(4, 1000)
+        limiter.throttled()
+        self.assertEqual(limiter.limit, 2)
+        # It grows back by one per limit successes
+        limiter.succeeded()
+        limiter.succeeded()
+        self.assertEqual(limiter.limit, 3)
+
+    def test_try_enter(self):
+        limiter = VAsysteem.HostLimiter(1, 1000)
+        self.assertTrue(limiter.tryEnter())
+        self.assertFalse(limiter.tryEnter())
+        limiter.leave()
+        self.assertTrue(limiter.tryEnter())
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(VAsysteem.retryAfter(FakeResponse(429, headers={'Retry-After': '3'})), 3.0)
+        self.assertEqual(VAsysteem.retryAfter(FakeResponse(429, headers={'Retry-After': '-1'})), 0.0)
+
+    def test_date(self):
+        wait = VAsysteem.retryAfter(FakeResponse(503, headers={'Retry-After': formatdate(time.time() + 30, usegmt=True)}))
+        self.assertGreater(wait, 25)
+        self.assertLessEqual(wait, 30)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(VAsysteem.retryAfter(FakeResponse(429)))
+        self.assertIsNone(VAsysteem.retryAfter(FakeResponse(429, headers={'Retry-After': 'soon'})))
+
+class RequestTest(RequestTestCase):
+    URL = 'https://query.wikidata.org/sparql'
+
+    def test_retries_until_success(self):
+        get = FakeGet(FakeResponse(503, headers={'Retry-After': '0'}), FakeResponse(500), FakeResponse(200, {'boolean': True}))
+        VAsysteem.session.get = get
+        self.assertEqual(VAsysteem.request(self.URL, {'query': 'ASK {}'}), {'boolean': True})
+        self.assertEqual(len(get.calls), 3)
+        # The 503 halved the concurrency of the host
+        limiter = VAsysteem.hostLimiter('query.wikidata.org')
+        self.assertEqual(limiter.limit, VAsysteem.MAX_CONCURRENCY_PER_HOST['query.wikidata.org'] // 2)
+
+    def test_no_retry_for_client_errors(self):
+        get = FakeGet(FakeResponse(400))
+        VAsysteem.session.get = get
+        with self.assertRaises(VAsysteem.WikidataError):
+            VAsysteem.request(self.URL, {'query': 'ASK {'})
+        self.assertEqual(len(get.calls), 1)
+
+    def test_gives_up_after_max_retries(self):
+        VAsysteem.MAX_RETRIES = 2
+        get = FakeGet(FakeResponse(502))
+        VAsysteem.session.get = get
+        with self.assertRaises(VAsysteem.WikidataError):
+            VAsysteem.request(self.URL, {'query': 'ASK {}'})
+        self.assertEqual(len(get.calls), 3)
+
+    def test_retry_budget(self):
+        get = FakeGet(FakeResponse(502))
+        VAsysteem.session.get = get
+        VAsysteem.hostLimiter('query.wikidata.org').retry_tokens = 1
+        with self.assertRaises(VAsysteem.WikidataError):
+            VAsysteem.request(self.URL, {'query': 'ASK {}'})
+        self.assertEqual(len(get.calls), 2)
+
+    def test_deadline(self):
+        get = FakeGet(FakeResponse(200))
+        VAsysteem.session.get = get
+        deadline = VAsysteem.Deadline(0.0)
+        with self.assertRaises(VAsysteem.DeadlineExceeded):
+            VAsysteem.request(self.URL, {'query': 'ASK {}'}, deadline=deadline)
+        self.assertEqual(get.calls, [])
+
+class HedgedGetTest(RequestTestCase):
+    URL = 'https://www.wikidata.org/w/api.php'
+
+    def slow(self):
+        time.sleep(0.3)
+        return FakeResponse(200, {'copy': 'slow'})
+
+    def test_slow_request_is_hedged(self):
+        VAsysteem.HEDGE_AFTER = {'www.wikidata.org': 0.05}
+        get = FakeGet(self.slow, FakeResponse(200, {'copy': 'fast'}))
+        VAsysteem.session.get = get
+        limiter = VAsysteem.HostLimiter(2, 1000)
+        limiter.enter()
+        response = VAsysteem.hedgedGet(self.URL, {}, limiter, timeout=1)
+        self.assertEqual(response.json(), {'copy': 'fast'})
+        self.assertEqual(len(get.calls), 2)
+        # The slow copy gives its slot back when it is done
+        time.sleep(0.4)
+        self.assertEqual(limiter.active, 0)
+
+    def test_no_hedge_without_a_free_slot(self):
+        VAsysteem.HEDGE_AFTER = {'www.wikidata.org': 0.05}
+        get = FakeGet(self.slow, FakeResponse(200, {'copy': 'fast'}))
+        VAsysteem.session.get = get
+        limiter = VAsysteem.HostLimiter(1, 1000)
+        limiter.enter()
+        self.assertEqual(VAsysteem.hedgedGet(self.URL, {}, limiter, timeout=1).json(), {'copy': 'slow'})
+        self.assertEqual(len(get.calls), 1)
+        self.assertEqual(limiter.active, 0)
+
+    def test_unlisted_host_is_not_hedged(self):
+        get = FakeGet(self.slow)
+        VAsysteem.session.get = get
+        limiter = VAsysteem.HostLimiter(2, 1000)
+        limiter.enter()
+        self.assertEqual(VAsysteem.hedgedGet(self.URL, {}, limiter, timeout=1).json(), {'copy': 'slow'})
+        self.assertEqual(len(get.calls), 1)
+
+class RecordingTest(RequestTestCase):
+    URL = 'https://www.wikidata.org/w/api.php'
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'recording.sqlite')
+
+    def tearDown(self):
+        self.dir.cleanup()
+        super().tearDown()
+
+    def test_record_and_replay(self):
+        live = FakeGet(FakeResponse(429), FakeResponse(200, {'search': [{'id': 'Q146'}]}))
+        recording = benchmark.Recording(self.path, 'record', live)
+        benchmark.install(recording)
+        params = {'action': 'wbsearchentities', 'search': 'kat', 'language': 'nl'}
+        self.assertEqual(VAsysteem.request(self.URL, params), {'search': [{'id': 'Q146'}]})
+        recording.close()
+        self.assertEqual(len(live.calls), 2)
+
+        def offline(url, params=None, timeout=None):
+            raise AssertionError('replay sent a request')
+
+        replay = benchmark.Recording(self.path, 'replay', offline)
+        benchmark.install(replay)
+        # The order of the parameters does not matter
+        reordered = {'language': 'nl', 'search': 'kat', 'action': 'wbsearchentities'}
+        self.assertEqual(VAsysteem.request(self.URL, reordered), {'search': [{'id': 'Q146'}]})
+        self.assertEqual(replay.misses, 0)
+        # Only the good response was recorded, a missing one is a 404
+        with self.assertRaises(VAsysteem.WikidataError):
+            VAsysteem.request(self.URL, dict(params, search='hond'))
+        self.assertEqual(replay.misses, 1)
+        self.assertEqual(replay.requests, 2)
+        replay.close()
+
+class ScoreTest(unittest.TestCase):
+    def test_score(self):
+        gold = [{'string': 'zwart'}, {'string': 'Bruin'}]
+        self.assertEqual(benchmark.score('bruin, zwart', gold), (True, True))
+        self.assertEqual(benchmark.score('bruin', gold), (False, True))
+        self.assertEqual(benchmark.score('wit', gold), (False, False))
+        self.assertEqual(benchmark.score('null', gold), (False, False))
+        self.assertEqual(benchmark.score('bruin', []), (False, False))
+
+    def test_percentile(self):
+        self.assertEqual(benchmark.percentile([3, 1, 2, 4], 50), 2)
+        self.assertEqual(benchmark.percentile([3, 1, 2, 4], 99), 4)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+if __name__ == '__main__':
+    unittest.main()